@@ -17,15 +17,114 @@
 import sys
 import time
 
+# Returned in place of the solution when the search stops at its node limit,
+# deadline or cancellation before finding a solution or proving there is none
+UNKNOWN = "UNKNOWN"
+
+# How often (in nodes expanded) search asks its donor whether it wants work
+DONATION_INTERVAL = 256
+
+# How often (in nodes expanded) search checks its deadline and cancel token
+INTERRUPT_INTERVAL = 64
+
+
+def interrupted(deadline, cancel):
+    """ Return True if the deadline (a time.time() value, or None for no
+        deadline) has passed, or the cancel token (anything with an is_set
+        method, such as a threading.Event, or None) has been set.
+
+        (float, object) -> bool
+    """
+    return ((deadline is not None and time.time() >= deadline) or
+            (cancel is not None and cancel.is_set()))
+
+
+def _finish(assignment, n_expanded_nodes, start_time, verbose):
+    """ Print how the search ended (if verbose) and return its result.
+
+        (object, int, float, bool) -> (object, int, float)
+    """
+    soln_time = time.time() - start_time
+    if verbose:
+        if assignment is None:
+            print("No solution!")
+        elif assignment == UNKNOWN:
+            print("Stopped without an answer!")
+        else:
+            print("Solved problem!")
+        print("Nodes expanded:", n_expanded_nodes)
+        print("Time:", soln_time)
+    return assignment, n_expanded_nodes, soln_time
+
+
+def _weigh_inference(csp, var, val, pruned_list):
+    """ Return the result of the inference after assigning val to var, as
+        the search should use it. If the CSP learns weights, a failed
+        inference (pruned_list is None) and one which wipes out a domain both
+        increase the weights of the constraints to blame, and both count as a
+        failure, so None is returned.
+
+        (CSP, str, str, [(str, str)]) -> [(str, str)]
+    """
+    if not csp.learn_weights:
+        return pruned_list
+    if pruned_list is None:
+        csp.increase_conflict_weights(csp.get_violated_constraints(var, val))
+        return None
+    wiped = csp.inference_wipeouts(var, pruned_list)
+    if wiped:
+        csp.increase_conflict_weights(wiped)
+        return None
+    return pruned_list
+
+
+def _undo_stack(csp, stack, assignment):
+    """ Undo the assignments of all the variables on the stack, except the
+        top one, which is not assigned yet, and empty the stack.
+
+        (CSP, list, {str : str}) -> None
+    """
+    stack.pop()
+    while stack:
+        csp.clear_assignment(stack.pop()[0], assignment)
+
+
+def _donate(stack, donor):
+    """ Give away the values not tried yet at the shallowest level of the
+        stack which has any: each becomes a list of decisions, the values of
+        the variables above it on the stack and then its own, which is passed
+        to donor.give. The values are then removed from the stack.
+
+        (list, object) -> None
+    """
+    for depth, (var, values, pos) in enumerate(stack):
+        if pos + 1 < len(values):
+            prefix = [(frame[0], frame[1][frame[2]]) for frame in stack[:depth]]
+            donor.give([prefix + [(var, val)] for val in values[pos + 1:]])
+            stack[depth][1] = values[:pos + 1]
+            return
+
 
 def search(csp, initial_assignment, select_unassigned_variable,
-           order_domain_values, inference):
+           order_domain_values, inference, node_limit=None, verbose=True,
+           donor=None, deadline=None, cancel=None):
     """ Do backtracking search on the CSP.
 
         Return the assignment found as a solution, the number of nodes expanded
         and the search time. If no solution can be found, None will be returned
         in place of the solution.
 
+        The search can be bounded: it stops once node_limit nodes have been
+        expanded, the deadline (a time.time() value) has passed or the cancel
+        token is set (see interrupted). It then undoes its assignments and
+        UNKNOWN is returned in place of the solution, with the number of nodes
+        expanded and the time so far. If verbose is False, nothing is printed.
+
+        If donor is given, every DONATION_INTERVAL nodes the search calls
+        donor.wanted(), and if it returns True, gives part of its remaining
+        search space to donor.give (see _donate), which becomes the donor's
+        job to search.
+
         (CSP, set([str]), (set([str]), CSP) -> ({str : str}, int, float)
     """
 
@@ -43,11 +142,7 @@ def search(csp, initial_assignment, select_unassigned_variable,
 
         # Check if all variables are assigned and we therefore have a solution
         if var is None:
-            print("Solved problem!")
-            print("Nodes expanded:", n_expanded_nodes)
-            soln_time = time.time() - start_time
-            print("Time:", soln_time)
-            return assignment, n_expanded_nodes, soln_time
+            return _finish(assignment, n_expanded_nodes, start_time, verbose)
 
         # Order the values for this variable
         values = order_domain_values(var, assignment, csp)
@@ -65,11 +160,7 @@ def search(csp, initial_assignment, select_unassigned_variable,
 
                 # We have run out of values for the very first variable, so UNSAT!
                 if not stack:
-                    print("No solution!")
-                    print("Nodes expanded:", n_expanded_nodes)
-                    soln_time = time.time() - start_time
-                    print("Time:", soln_time)
-                    return None, n_expanded_nodes, soln_time
+                    return _finish(None, n_expanded_nodes, start_time, verbose)
 
                 # We are making the next decision at the backtracked level
                 stack[-1][2] += 1
@@ -81,15 +172,27 @@ def search(csp, initial_assignment, select_unassigned_variable,
                 csp.clear_assignment(undo_var, assignment)
                 continue
 
+            if (n_expanded_nodes == node_limit or
+                    n_expanded_nodes % INTERRUPT_INTERVAL == 0 and interrupted(deadline, cancel)):
+                _undo_stack(csp, stack, assignment)
+                return _finish(UNKNOWN, n_expanded_nodes, start_time, verbose)
+
             n_expanded_nodes += 1
 
+            if (donor is not None and n_expanded_nodes % DONATION_INTERVAL == 0
+                    and donor.wanted()):
+                _donate(stack, donor)
+
             val = values[pos]
 
             # Check if setting this value would cause a direct conflict. This
             # involves looping through all the immediate neighbours of vars. If
             # there exists at least one neighbour with an empty domain after we
-            # assign val to var, then we skip this iteration.
+            # assign val to var, then we skip this iteration (making the
+            # constraints which failed weigh more, for dom/wdeg).
             if csp.count_conflicts(var, val):
+                if csp.learn_weights:
+                    csp.increase_conflict_weights(csp.get_violated_constraints(var, val))
                 stack[-1][2] += 1
                 continue
 
@@ -101,7 +204,7 @@ def search(csp, initial_assignment, select_unassigned_variable,
 
             # Use the inference function to do constraint propagation, which will
             # possibly make more assignments or detect a conflict
-            pruned_list = inference(var, assignment, csp)
+            pruned_list = _weigh_inference(csp, var, val, inference(var, assignment, csp))
 
             # If there is a conflict, undo the last assignment and get ready to
             # try the next one
@@ -116,3 +219,341 @@ def search(csp, initial_assignment, select_unassigned_variable,
             # Given our best knowledge, there is no conflict yet, so we go back
             # up to the outer loop and continue to choose a new variable
             break
+
+
+def search_cbj(csp, initial_assignment, select_unassigned_variable,
+               order_domain_values, inference, local_explanations=False,
+               nogoods=None, node_limit=None, verbose=True, deadline=None,
+               cancel=None):
+    """ Do backtracking search on the CSP with conflict-directed backjumping.
+
+        Each variable on the stack keeps a conflict set: the earlier
+        variables which are to blame for its values failing. When it runs out
+        of values, we jump straight back to the deepest variable in its
+        conflict set, which inherits the rest of the set, instead of to the
+        previous variable.
+
+        If local_explanations is True, the inference function must only prune
+        values which conflict with the variable just assigned (as forward
+        checking does), so that each pruning can be blamed on that assignment
+        alone. Otherwise, it is blamed on all the assignments so far.
+
+        If nogoods is a NogoodStore, then each time a variable runs out of
+        values, the current values of its conflict set are learned as a
+        nogood, and values forbidden by the stored nogoods are skipped.
+
+        Return the assignment found as a solution, the number of nodes expanded
+        and the search time. If no solution can be found, None will be returned
+        in place of the solution.
+
+        (CSP, set([str]), (set([str]), CSP) -> ({str : str}, int, float)
+    """
+
+    start_time = time.time()
+    assignment = dict(initial_assignment)
+
+    # The stack will contain a list of [var, values, val_pos, conflict_set]
+    stack = []
+
+    n_expanded_nodes = 0
+    while True:
+        # Select the variable to be expanded
+        var = select_unassigned_variable(assignment, csp)
+
+        # Check if all variables are assigned and we therefore have a solution
+        if var is None:
+            return _finish(assignment, n_expanded_nodes, start_time, verbose)
+
+        # Order the values for this variable
+        values = order_domain_values(var, assignment, csp)
+
+        # Push the new variable onto the stack so we can go through its values.
+        # The values already pruned from its domain are missing from values,
+        # so whoever pruned them is to blame from the start.
+        stack.append([var, values, 0, csp.domain_culprits(var, local_explanations)])
+
+        # Try and assign the values in the given order
+        while True:
+            var, values, pos, conflict_set = stack[-1]
+
+            if pos >= len(values):
+                # There are no more values, so backjump to the deepest
+                # variable in the conflict set, undoing everything above it
+                stack.pop()
+                conflict_set.discard(var)
+
+                # The values of the conflict set cannot all hold in a
+                # solution, so remember them, most recently assigned first
+                if nogoods is not None:
+                    on_stack = [frame[0] for frame in reversed(stack)
+                                if frame[0] in conflict_set]
+                    fixed = conflict_set.difference(on_stack)
+                    nogoods.learn([(ovar, assignment[ovar]) for ovar in on_stack] +
+                                  [(ovar, assignment[ovar]) for ovar in fixed
+                                   if ovar in assignment])
+
+                while stack and stack[-1][0] not in conflict_set:
+                    csp.clear_assignment(stack.pop()[0], assignment)
+
+                # Nothing we can change is to blame, so UNSAT!
+                if not stack:
+                    return _finish(None, n_expanded_nodes, start_time, verbose)
+
+                # The culprit inherits the rest of the conflict set, and makes
+                # its next decision
+                undo_var = stack[-1][0]
+                conflict_set.discard(undo_var)
+                stack[-1][3].update(conflict_set)
+                stack[-1][2] += 1
+                csp.clear_assignment(undo_var, assignment)
+                continue
+
+            if (n_expanded_nodes == node_limit or
+                    n_expanded_nodes % INTERRUPT_INTERVAL == 0 and interrupted(deadline, cancel)):
+                _undo_stack(csp, stack, assignment)
+                return _finish(UNKNOWN, n_expanded_nodes, start_time, verbose)
+
+            n_expanded_nodes += 1
+
+            val = values[pos]
+
+            # If setting this value would wipe out the domain of a neighbour,
+            # whoever reduced that domain is to blame
+            if csp.count_conflicts(var, val):
+                violated = csp.get_violated_constraints(var, val)
+                if csp.learn_weights:
+                    csp.increase_conflict_weights(violated)
+                for _, ovar in violated:
+                    conflict_set.update(csp.domain_culprits(ovar, local_explanations))
+                stack[-1][2] += 1
+                continue
+
+            # If a learned nogood forbids this value, the other variables in
+            # the nogood are to blame
+            if nogoods is not None:
+                nogood = nogoods.forbids(var, val, assignment)
+                if nogood is not None:
+                    conflict_set.update(ovar for ovar, _ in nogood if ovar != var)
+                    stack[-1][2] += 1
+                    continue
+
+            csp.make_assignment(var, val)
+            assignment[var] = val
+            if nogoods is not None:
+                nogoods.assign(var, val, assignment)
+
+            # If the inference finds a conflict, we do not know why, so all
+            # the earlier assignments are to blame
+            pruned_list = _weigh_inference(csp, var, val, inference(var, assignment, csp))
+            if pruned_list is None:
+                conflict_set.update(assignment)
+                conflict_set.discard(var)
+                stack[-1][2] += 1
+                csp.clear_assignment(var, assignment)
+                continue
+
+            csp.notify_of_inference(var, assignment, pruned_list)
+            break
+
+
+def luby(i):
+    """ Return the i-th term (counting from 1) of the Luby sequence
+        1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ...
+
+        (int) -> int
+    """
+    while True:
+        k = i.bit_length()
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i -= (1 << (k - 1)) - 1
+
+
+def search_restarts(csp, initial_assignment, select_unassigned_variable,
+                    order_domain_values, inference, schedule="luby", cutoff=100,
+                    growth=1.5, cbj=False, local_explanations=False, nogoods=None,
+                    verbose=True, node_limit=None, deadline=None, cancel=None):
+    """ Do backtracking search on the CSP, restarting it from scratch whenever
+        it expands more nodes than the cutoff of the current run.
+
+        The cutoff of the i-th run is cutoff * luby(i) if schedule is "luby",
+        or cutoff * growth ** (i - 1) if it is "geometric". Restarts only pay
+        off if the runs differ, so csp.rng should be set to make the
+        heuristics break ties randomly. Whatever the runs learn is kept: the
+        constraint weights of the CSP and, if cbj is True, the nogoods in the
+        given NogoodStore (see search_cbj). If verbose is False, nothing is
+        printed.
+
+        node_limit bounds the total number of nodes expanded by all the runs,
+        and deadline and cancel apply to all of them, as for search.
+
+        Return the assignment found as a solution, the total number of nodes
+        expanded and the search time. If no solution can be found, None will
+        be returned in place of the solution.
+
+        (CSP, set([str]), (set([str]), CSP) -> ({str : str}, int, float)
+    """
+    start_time = time.time()
+    n_expanded_nodes = 0
+    run = 0
+    while True:
+        run += 1
+        if schedule == "luby":
+            run_limit = cutoff * luby(run)
+        elif schedule == "geometric":
+            run_limit = int(cutoff * growth ** (run - 1))
+        else:
+            raise ValueError("Unknown restart schedule: {}".format(schedule))
+        if node_limit is not None:
+            run_limit = min(run_limit, node_limit - n_expanded_nodes)
+
+        if cbj:
+            assignment, explored, _ = search_cbj(
+                csp, initial_assignment, select_unassigned_variable,
+                order_domain_values, inference, local_explanations, nogoods,
+                node_limit=run_limit, verbose=False, deadline=deadline,
+                cancel=cancel)
+        else:
+            assignment, explored, _ = search(
+                csp, initial_assignment, select_unassigned_variable,
+                order_domain_values, inference, node_limit=run_limit,
+                verbose=False, deadline=deadline, cancel=cancel)
+        n_expanded_nodes += explored
+
+        if (assignment != UNKNOWN or n_expanded_nodes == node_limit or
+                interrupted(deadline, cancel)):
+            if verbose:
+                print("Restarts:", run - 1)
+            return _finish(assignment, n_expanded_nodes, start_time, verbose)
+
+
+def _search_all(csp, initial_assignment, select_unassigned_variable,
+                order_domain_values, inference, stats, node_limit=None, deadline=None):
+    """ Do backtracking search on the CSP, yielding the assignment each time
+        it is a solution and then carrying on with the search. The same dict
+        is yielded every time, and changes as the search goes on.
+        stats["nodes"] is kept up to date with the number of nodes expanded.
+        If the generator is closed early, the assignments made are undone.
+
+        The search stops early, as for search, once node_limit nodes have been
+        expanded or the deadline has passed. stats["stopped"] is then True.
+    """
+    assignment = dict(initial_assignment)
+
+    # The stack will contain a list of [var, values, val_pos], as in search
+    stack = []
+
+    stats["nodes"] = 0
+    stats["stopped"] = False
+    try:
+        while True:
+            var = select_unassigned_variable(assignment, csp)
+
+            if var is None:
+                yield assignment
+
+                # Carry on as if the last assignment had failed
+                if not stack:
+                    return
+                stack[-1][2] += 1
+                csp.clear_assignment(stack[-1][0], assignment)
+            else:
+                values = order_domain_values(var, assignment, csp)
+                stack.append([var, values, 0])
+
+            while True:
+                var, values, pos = stack[-1]
+
+                if pos >= len(values):
+                    stack.pop()
+
+                    # We have run out of values for the very first variable,
+                    # so there are no more solutions
+                    if not stack:
+                        return
+
+                    stack[-1][2] += 1
+                    csp.clear_assignment(stack[-1][0], assignment)
+                    continue
+
+                if (stats["nodes"] == node_limit or
+                        stats["nodes"] % INTERRUPT_INTERVAL == 0 and interrupted(deadline, None)):
+                    stats["stopped"] = True
+                    _undo_stack(csp, stack, assignment)
+                    return
+
+                stats["nodes"] += 1
+
+                val = values[pos]
+                if csp.count_conflicts(var, val):
+                    if csp.learn_weights:
+                        csp.increase_conflict_weights(csp.get_violated_constraints(var, val))
+                    stack[-1][2] += 1
+                    continue
+
+                csp.make_assignment(var, val)
+                assignment[var] = val
+
+                pruned_list = _weigh_inference(csp, var, val, inference(var, assignment, csp))
+                if pruned_list is None:
+                    stack[-1][2] += 1
+                    csp.clear_assignment(var, assignment)
+                    continue
+
+                csp.notify_of_inference(var, assignment, pruned_list)
+                break
+    finally:
+        # Only reached with variables on the stack if we were closed at a
+        # solution, when they are all assigned
+        while stack:
+            csp.clear_assignment(stack.pop()[0], assignment)
+
+
+def solutions(csp, initial_assignment, select_unassigned_variable,
+              order_domain_values, inference, stats=None, node_limit=None, deadline=None):
+    """ Generate the solutions of the CSP, one at a time, as they are found by
+        backtracking search. Each solution is a new dict.
+
+        If stats is a dict, stats["nodes"] is kept up to date with the number
+        of nodes expanded so far. Closing the generator early undoes the
+        assignments of the search. The search stops once node_limit nodes have
+        been expanded or the deadline has passed, and stats["stopped"] is then
+        set to True.
+
+        (CSP, {str : str}, ...) -> iter({str : str})
+    """
+    if stats is None:
+        stats = {}
+    for assignment in _search_all(csp, initial_assignment, select_unassigned_variable,
+                                  order_domain_values, inference, stats, node_limit, deadline):
+        yield dict(assignment)
+
+
+def count_solutions(csp, initial_assignment, select_unassigned_variable,
+                    order_domain_values, inference, limit=None, node_limit=None,
+                    deadline=None):
+    """ Count the solutions of the CSP with backtracking search, stopping
+        once limit solutions (if given) have been found. The solutions are
+        not copied. The search also stops once node_limit nodes have been
+        expanded or the deadline has passed.
+
+        Return the number of solutions, the number of nodes expanded, the
+        search time and whether the search stopped before it had looked at
+        every assignment (at the node limit or the deadline, but not at the
+        solution limit). Nothing is printed.
+
+        (CSP, {str : str}, ..., int, int, float) -> (int, int, float, bool)
+    """
+    start_time = time.time()
+    stats = {}
+    n_solutions = 0
+    if limit is None or limit > 0:
+        search_all = _search_all(csp, initial_assignment, select_unassigned_variable,
+                                 order_domain_values, inference, stats, node_limit, deadline)
+        for _ in search_all:
+            n_solutions += 1
+            if n_solutions == limit:
+                search_all.close()
+                break
+
+    return n_solutions, stats.get("nodes", 0), time.time() - start_time, stats.get("stopped", False)
@@ -0,0 +1,129 @@
+# COMP3620/6320 Artificial Intelligence
+# The Australian National University
+# Authors: COMP-3620 team
+# Date:    2021
+
+""" This file checks conflict-directed backjumping and nogood learning
+    against plain backtracking search on the bundled problems.
+
+    For each problem, plain backtracking, CBJ, CBJ with a small nogood store
+    (so that nogoods get evicted) and CBJ with nogoods and restarts must all
+    agree on whether there is a solution, and each solution found must
+    satisfy every constraint. Restarts can take many more nodes, so that
+    search is bounded, and gives no answer (which is not compared) if it
+    reaches its node limit.
+
+    Run it from the top directory of the repository:
+        python check_nogoods.py [CSP_FILE ...]
+    It prints one line per problem and exits with status 1 if any check
+    failed.
+"""
+
+import glob
+import random
+import sys
+
+import backtracking_search
+from csp import CSP
+from heuristics import next_variable_mrv, value_ordering_lex
+from inference import get_inference_function
+from nogoods import NogoodStore
+
+# The problems checked if none are given on the command line
+DEFAULT_PROBLEMS = sorted(glob.glob("test_problems/*.csp")) + ["nary_problems/binarised_03.csp"]
+
+# The capacity of the small nogood store, which makes it evict nogoods
+SMALL_CAPACITY = 20
+
+# The node limit of the search with restarts
+RESTART_NODE_LIMIT = 20000
+
+
+def violated(csp, assignment):
+    """ Return a description of a constraint of the CSP which the assignment
+        violates, or of a variable it leaves unassigned, or None if it is a
+        solution.
+
+        (CSP, {str : str}) -> str
+    """
+    for var in csp.variables:
+        if var not in assignment:
+            return var + " is not assigned"
+        var_id = csp.var_ids[var]
+        bit = csp.value_ids[var_id][assignment[var]]
+        for ovar in csp.neighbours[var]:
+            ovar_id = csp.var_ids[ovar]
+            obit = csp.value_ids[ovar_id][assignment[ovar]]
+            if not (csp.arc_supports(var_id, ovar_id)[bit] >> obit) & 1:
+                return "{}={} conflicts with {}={}".format(var, assignment[var],
+                                                           ovar, assignment[ovar])
+    return None
+
+
+def run(file_name, configuration):
+    """ Parse the CSP file and search it with the named configuration.
+        Return the result of the search, or a description of what is wrong
+        with the solution it found.
+
+        (str, str) -> ({str : str}, int, float)
+    """
+    csp = CSP()
+    if not csp.parse_csp_file(file_name):
+        raise SystemExit("[Fatal]: could not parse " + file_name)
+    infer = get_inference_function(None)
+    if configuration == "backtracking":
+        result = backtracking_search.search(csp, {}, next_variable_mrv, value_ordering_lex,
+                                            infer, verbose=False)
+    elif configuration == "cbj":
+        result = backtracking_search.search_cbj(csp, {}, next_variable_mrv, value_ordering_lex,
+                                                infer, local_explanations=True, verbose=False)
+    elif configuration == "cbj-nogoods":
+        result = backtracking_search.search_cbj(csp, {}, next_variable_mrv, value_ordering_lex,
+                                                infer, local_explanations=True,
+                                                nogoods=NogoodStore(SMALL_CAPACITY),
+                                                verbose=False)
+    else:
+        csp.rng = random.Random(8193)
+        result = backtracking_search.search_restarts(csp, {}, next_variable_mrv,
+                                                     value_ordering_lex, infer, schedule="luby",
+                                                     cbj=True, local_explanations=True,
+                                                     nogoods=NogoodStore(),
+                                                     node_limit=RESTART_NODE_LIMIT, verbose=False)
+    assignment = result[0]
+    if assignment is not None and assignment != backtracking_search.UNKNOWN:
+        problem = violated(csp, assignment)
+        if problem is not None:
+            return "invalid solution: " + problem
+    return result
+
+
+def main():
+    """ Check every problem given on the command line, or the bundled ones.
+        () -> None
+    """
+    file_names = sys.argv[1:] or DEFAULT_PROBLEMS
+    n_failed = 0
+    for file_name in file_names:
+        answers = {}
+        for configuration in ("backtracking", "cbj", "cbj-nogoods", "cbj-restarts"):
+            result = run(file_name, configuration)
+            if isinstance(result, str):
+                answers[configuration] = result
+            elif result[0] == backtracking_search.UNKNOWN:
+                answers[configuration] = "UNKNOWN"
+            else:
+                answers[configuration] = "UNSAT" if result[0] is None else "SAT"
+        agreed = (set(answers.values()).difference(["UNKNOWN"]) == {answers["backtracking"]}
+                  and answers["backtracking"] in ("SAT", "UNSAT"))
+        if not agreed:
+            n_failed += 1
+        print("{:40} {}".format(file_name, answers["backtracking"] if agreed else
+                                "FAILED " + str(answers)))
+    if n_failed:
+        print(n_failed, "problems failed")
+        sys.exit(1)
+    print("All problems passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,26 +22,249 @@
     ********** Do not modify any code in this file **********
 """
 
+import copy
+import heapq
 import itertools
+import mmap
 import os
-from typing import Dict, List, Set, Tuple
+import pickle
+from collections.abc import Mapping, Set as AbstractSet
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 Variable = str
 Value = str
 Pair = Tuple[Variable, Value]
 VarPair = Tuple[Variable, Variable]
 
+# Bump this whenever the attributes of CSP change, to invalidate old sidecars
+COMPILED_VERSION = 8
+
+# CSP.write collects this many characters before writing them to the file
+WRITE_CHUNK_SIZE = 1 << 20
+
+
+def compiled_file_name(csp_file_name: str) -> str:
+    """Return the name of the compiled sidecar of the given CSP file."""
+    return os.path.splitext(csp_file_name)[0] + ".cspb"
+
+
+def popcount(mask: int) -> int:
+    """Return the number of values in the given domain bitmask."""
+    return bin(mask).count("1")
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """Yield the positions of the set bits of the given mask, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class DomainSet(AbstractSet):
+    """ A read-only, set-like view of the current domain of one variable.
+
+        The domain is stored as a bitmask inside the CSP, so taking the
+        length or testing membership never builds a set of strings.
+    """
+
+    __slots__ = ("_csp", "_var_id")
+
+    def __init__(self, csp, var_id):
+        self._csp = csp
+        self._var_id = var_id
+
+    def __contains__(self, val):
+        bit = self._csp.value_ids[self._var_id].get(val)
+        return bit is not None and (self._csp.domain_masks[self._var_id] >> bit) & 1 == 1
+
+    def __iter__(self):
+        values = self._csp.value_lists[self._var_id]
+        for bit in iter_bits(self._csp.domain_masks[self._var_id]):
+            yield values[bit]
+
+    def __len__(self):
+        return popcount(self._csp.domain_masks[self._var_id])
+
+    def __repr__(self):
+        return repr(set(self))
+
+    def copy(self) -> Set[Value]:
+        """Return the current domain as a plain (mutable) set of values."""
+        return set(self)
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return set(self)
+
+
+class DomainView(Mapping):
+    """ A read-only mapping from variable names to their current domains.
+
+        Copying this view (with copy.copy or copy.deepcopy) gives a plain
+        dictionary of sets which can be freely modified.
+    """
+
+    __slots__ = ("_csp",)
+
+    def __init__(self, csp):
+        self._csp = csp
+
+    def __getitem__(self, var):
+        return DomainSet(self._csp, self._csp.var_ids[var])
+
+    def __iter__(self):
+        return iter(self._csp.variables)
+
+    def __len__(self):
+        return len(self._csp.variables)
+
+    def __contains__(self, var):
+        return var in self._csp.var_ids
+
+    def copy(self) -> Dict[Variable, Set[Value]]:
+        """Return the current domains as a dictionary of plain sets."""
+        return {var: set(self[var]) for var in self._csp.variables}
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+
+class ConflictView(Mapping):
+    """ A read-only mapping from (variable, value) pairs to the values of the
+        neighbouring variables that conflict with them, as in
+        {neighbour: {value, ...}}. Each entry is built on request from the
+        interned support masks.
+    """
+
+    __slots__ = ("_csp",)
+
+    def __init__(self, csp):
+        self._csp = csp
+
+    def __getitem__(self, pair):
+        var, val = pair
+        csp = self._csp
+        var_id = csp.var_ids[var]
+        bit = csp.value_ids[var_id][val]
+        conflicts = {}
+        for ovar in csp.neighbours[var]:
+            ovar_id = csp.var_ids[ovar]
+            ovalues = csp.value_lists[ovar_id]
+            omask = ((1 << len(ovalues)) - 1) & ~csp.arc_supports(var_id, ovar_id)[bit]
+            conflicts[ovar] = set(ovalues[obit] for obit in iter_bits(omask))
+        return conflicts
+
+    def __iter__(self):
+        csp = self._csp
+        for var in csp.variables:
+            for val in csp.value_lists[csp.var_ids[var]]:
+                yield (var, val)
+
+    def __len__(self):
+        csp = self._csp
+        return sum(len(csp.value_lists[csp.var_ids[var]]) for var in csp.variables)
+
+    def __contains__(self, pair):
+        try:
+            var, val = pair
+            return val in self._csp.value_ids[self._csp.var_ids[var]]
+        except (KeyError, TypeError, ValueError):
+            return False
+
+
+class BucketQueue:
+    """ A priority queue of variable ids for the heuristics, where each id has
+        a small non-negative integer priority, lowest first. The ids of each
+        priority are kept in a heap, ordered by a tie key given with them
+        (such as their lexicographic rank).
+
+        Entries are deleted lazily: an entry in the heap of a priority is only
+        valid while its id still has that priority and tie key.
+    """
+
+    __slots__ = ("heaps", "priorities", "keys", "hint", "limit")
+
+    def __init__(self, n_priorities, n_ids, n_members):
+        self.heaps: List[List[Tuple[object, int]]] = [[] for _ in range(n_priorities)]
+        # The priority of each id, or -1 if it is not in the queue
+        self.priorities = [-1] * n_ids
+        self.keys: List[object] = [None] * n_ids
+        # No heap below this priority has a valid entry
+        self.hint = 0
+        # A heap longer than this is compacted, so the heaps do not keep
+        # growing with stale entries
+        self.limit = 2 * n_members + 16
+
+    def push(self, var_id, priority, key):
+        """Give the id the priority, with the given tie key."""
+        self.priorities[var_id] = priority
+        self.keys[var_id] = key
+        heap = self.heaps[priority]
+        heapq.heappush(heap, (key, var_id))
+        if priority < self.hint:
+            self.hint = priority
+        if len(heap) > self.limit:
+            heap[:] = self._valid(priority)
+
+    def remove(self, var_id):
+        """Take the id out of the queue."""
+        self.priorities[var_id] = -1
+
+    def _valid(self, priority):
+        """Return the valid entries of the priority, in order, once each."""
+        priorities = self.priorities
+        keys = self.keys
+        return sorted(set(entry for entry in self.heaps[priority]
+                          if priorities[entry[1]] == priority and keys[entry[1]] == entry[0]))
+
+    def best(self, exclude, first_only=False):
+        """ Return the ids of the lowest priority, in order of their tie keys,
+            leaving out those for which exclude(id) is True. If first_only is
+            True, only the first of them is returned (this takes constant
+            time, amortised, unless it is excluded).
+        """
+        priorities = self.priorities
+        keys = self.keys
+        for priority in range(self.hint, len(self.heaps)):
+            heap = self.heaps[priority]
+            while heap and (priorities[heap[0][1]] != priority or
+                            keys[heap[0][1]] != heap[0][0]):
+                heapq.heappop(heap)
+            if not heap:
+                self.hint = priority + 1
+                continue
+            if first_only and not exclude(heap[0][1]):
+                return [heap[0][1]]
+            ids = [var_id for _, var_id in self._valid(priority) if not exclude(var_id)]
+            if ids:
+                return ids[:1] if first_only else ids
+        return []
+
 
 class CSP:
     """ A CSP which we can either parse from a file, or directly add variables
         and constraints to.
     """
 
-    def __init__(self):
-        """Make a new CSP with no variables."""
+    def __init__(self, lazy=False, keep_ground_conflicts=True):
+        """ Make a new CSP with no variables. If lazy is True, the tables of
+            the constraints given by add_constraint are only built when they
+            are first needed. If keep_ground_conflicts is False, the lists of
+            allowed pairs given to add_constraint are not kept once the tables
+            are built, and write regenerates them from the tables.
+        """
         # Here variables are strings
         self.variables: List[Variable] = []
 
+        # All the variables, by id (see var_ids). This is the same as
+        # `variables`, except in a fork of some components of the problem,
+        # where `variables` only has the variables to search.
+        self.var_names: List[Variable] = []
+
         # Each variable has a domain of possible values (these do not change throughout search)
         self.domains: Dict[Variable, List[Value]] = {}
 
@@ -49,27 +272,127 @@ class CSP:
         # constraints with
         self.neighbours: Dict[Variable, Set[Variable]] = {}
 
+        # Internally, every variable is interned to a dense integer id (its
+        # position in `var_names`), and every value of a variable to a bit
+        # position (its position in the declared domain of the variable).
+        # value_lists[id] maps bit positions back to values.
+        self.var_ids: Dict[Variable, int] = {}
+        self.value_lists: List[List[Value]] = []
+        self.value_ids: List[Dict[Value, int]] = []
+
+        # The conflicts graph in interned form, stored as per-arc supports.
+        # supports[id][oid] is a list indexed by the bit positions of `id`:
+        # supports[id][oid][bit] is the bitmask of the values of `oid` which
+        # are compatible with giving `id` the value at position `bit`. The
+        # neighbour still has a compatible value iff this mask intersects its
+        # current domain mask.
+        # In lazy mode, the supports of an arc which has not been needed yet
+        # are None, and the allowed pairs of its constraints wait in
+        # pending_tables, under the (smaller id, larger id) key, as
+        # (id of the first variable, value_list) pairs. Use arc_supports to
+        # get the supports of any arc.
+        self.lazy = lazy
+        self.supports: List[Dict[int, Optional[List[int]]]] = []
+        self.pending_tables: Dict[Tuple[int, int], List[Tuple[int, List[Pair]]]] = {}
+        self.conflict_weights = {}
+
+        # Inequality and equality constraints are not stored as tables, but
+        # checked by comparing values. inequalities[id] and equalities[id]
+        # are the ids of the neighbours `id` must differ from / be equal to.
+        # A pair of variables has at most one arc: either one of these, or a
+        # table in supports.
+        self.inequalities: List[Set[int]] = []
+        self.equalities: List[Set[int]] = []
+
+        # A list of ground conflicts in case we want to display them. Each is
+        # a (kind, scope, value_list) tuple where kind is "con", "neq",
+        # "alldiff" or "allsame", as in the CSP file format. Only "con"
+        # constraints have a value_list of allowed pairs, and only if
+        # keep_ground_conflicts is True (otherwise it is None).
+        self.keep_ground_conflicts = keep_ground_conflicts
+        self.ground_conflicts: List[Tuple[str, Tuple[Variable, ...],
+                                          Optional[List[Pair]]]] = []
+
+        # Throughout search, the domains of variables will shrink as we make
+        # decisions and do inference. domain_masks[id] is the bitmask of the
+        # values still in the domain of variable `id`. This starts out being
+        # the same as domains.
+        self.domain_masks: List[int] = []
+
         # The conflicts graph is a dictionary that stores all conflicts. The
         # key of this dictionary is a (variable, value) pair. Let us call this
         # key X. The value of the dictionary is another dictionary, which maps
         # other variables to the values that conflict with X.
-        self.conflicts: Dict[Pair, Dict[Variable, Set[Value]]] = {}
-        self.conflict_weights = {}
-
-        # A list of ground conflicts in case we want to display them
-        self.ground_conflicts: List[str] = []
+        # This is a read-only view of supports.
+        self.conflicts: Dict[Pair, Dict[Variable, Set[Value]]] = ConflictView(self)
 
-        # Throughout search, the domains of variables will shrink as we make
-        # decisions and do inference. This starts out being the same as domains
-        self.current_domains: Dict[Variable, Set[Value]] = {}
+        # The current domains as a dictionary mapping each variable to the
+        # set of its remaining values. This is a read-only view of domain_masks.
+        self.current_domains: Dict[Variable, Set[Value]] = DomainView(self)
 
         # Whenever changes to domains we need to backtrack. You do not need to use it directly.
-        self.undo_domains: Dict[Variable, Set[Pair]] = {}
-        self.undo_domains[None] = set()
+        # All the changes are recorded on a single trail, as a flat list of
+        # (variable id, mask of removed values) records. Only the first
+        # trail_height entries are in use; the list is grown by doubling.
+        self.trail: List[int] = [0] * 1024
+        self.trail_height = 0
 
         # Whenever changes to assignments we need to backtrack. You do not need to use it directly.
-        self.undo_assignments: Dict[Variable, Set[Variable]] = {}
-        self.undo_assignments[None] = set()
+        # For each assignment, in order, the id of the assigned variable and
+        # the height of the trail when it was made.
+        self.trail_vars: List[int] = []
+        self.trail_marks: List[int] = []
+
+        # If not None, a random.Random which the heuristics use to break ties
+        # between variables and values, instead of lexicographic order. Search
+        # with restarts sets it so that each run explores a different tree.
+        self.rng = None
+
+        # True if the values are interchangeable: every variable has the same
+        # domain, and swapping any two values throughout a solution gives
+        # another solution. This looks at every constraint, so it is only
+        # worked out on request: set it from find_interchangeable_values.
+        self.interchangeable_values = False
+
+        # The static lexicographic orders, for the lex heuristics. lex_order
+        # lists `variables` in lexicographic order, and lex_ranks[id] is the
+        # position of each variable in it (-1 for those not in `variables`).
+        # lex_value_orders[id] lists the bit positions of the values of each
+        # variable in lexicographic order of the values. These are worked out
+        # when the CSP is parsed (or first needed, if it is built otherwise).
+        # All the variables before position lex_cursor in lex_order are
+        # assigned (see first_unassigned_variable).
+        self.lex_order: Optional[List[Variable]] = None
+        self.lex_ranks: Optional[List[int]] = None
+        self.lex_value_orders: List[List[int]] = []
+        self.lex_cursor = 0
+
+        # If True, the search calls increase_conflict_weights with the
+        # constraints which made each failed value fail, directly or through
+        # a domain wiped out by inference. The solver sets it for the
+        # dom/wdeg heuristic, which reads the weights.
+        self.learn_weights = False
+
+        # The unassigned variables of `variables` in BucketQueues, for the
+        # MRV and MD heuristics. In size_queue, their priority is the size of
+        # their current domain (see smallest_domain_variables), and in
+        # degree_queue it is how many fewer unassigned neighbours they have
+        # than the most any variable has (see largest_degree_variables).
+        # The tie keys end with the lexicographic rank of the variable
+        # (lex_ranks[id]), and may start
+        # with how many unassigned neighbours it has (in size_queue, if
+        # size_ties_by_degree is True) or the size of its static domain (in
+        # degree_queue, if degree_ties_by_size is True). The queues are only
+        # built when first needed, and are then kept up to date by
+        # make_assignment, notify_of_inference and clear_assignment, as are
+        # unassigned_degrees[id], the number of unassigned neighbours of each
+        # variable, once built.
+        self.size_queue: Optional[BucketQueue] = None
+        self.degree_queue: Optional[BucketQueue] = None
+        self.size_ties_by_degree = False
+        self.degree_ties_by_size = False
+        self.unassigned_degrees: Optional[List[int]] = None
+        self.neighbour_ids: List[List[int]] = []
 
     def count_conflicts(self, var: Variable, val: Value) -> int:
         """Count the constraints that would be violated by making this assignment."""
@@ -78,34 +401,197 @@ class CSP:
         # neighbour, we ask if there is at least one value that we can assign
         # to the neighbour that doesn't conflict with `var`. If no such
         # assignment is possible, we increment `n_conflicts` by 1.
+        var_id = self.var_ids[var]
+        bit = self.value_ids[var_id][val]
+        masks = self.domain_masks
         n_conflicts = 0
-        for ovar, ovals in self.conflicts[(var, val)].items():
-            any_valid = False
-            for oval in self.current_domains[ovar]:
-                if oval not in ovals:
-                    any_valid = True
-                    break
-            if not any_valid:
+        for ovar_id, support in self.supports[var_id].items():
+            if support is None:
+                support = self._build_arc(var_id, ovar_id)
+            if not masks[ovar_id] & support[bit]:
+                n_conflicts += 1
+
+        # For (in)equalities, we look for the same value in the neighbour.
+        # Variables declared together share their value index, so usually
+        # the value has the same bit position in the neighbour.
+        value_ids = self.value_ids
+        ids = value_ids[var_id]
+        for ovar_id in self.inequalities[var_id]:
+            obit = bit if value_ids[ovar_id] is ids else value_ids[ovar_id].get(val)
+            omask = masks[ovar_id]
+            if not omask or (obit is not None and omask == 1 << obit):
+                n_conflicts += 1
+        for ovar_id in self.equalities[var_id]:
+            obit = bit if value_ids[ovar_id] is ids else value_ids[ovar_id].get(val)
+            if obit is None or not (masks[ovar_id] >> obit) & 1:
                 n_conflicts += 1
         return n_conflicts
 
+    def value_impacts(self, var: Variable) -> Dict[Value, Tuple[int, int]]:
+        """ Return what giving the variable each value in its current domain
+            would do to its neighbours, as a (number of neighbours whose
+            domain would be wiped out, number of values which would be ruled
+            out of the domains of neighbours) pair for each value. All the
+            values are done at once, with one pass over the neighbours.
+        """
+        var_id = self.var_ids[var]
+        masks = self.domain_masks
+        values = self.value_lists[var_id]
+        bits = list(iter_bits(masks[var_id]))
+        wiped = [0] * len(values)
+        ruled_out = [0] * len(values)
+        for ovar_id, support in self.supports[var_id].items():
+            if support is None:
+                support = self._build_arc(var_id, ovar_id)
+            omask = masks[ovar_id]
+            osize = popcount(omask)
+            for bit in bits:
+                left = omask & support[bit]
+                if not left:
+                    wiped[bit] += 1
+                ruled_out[bit] += osize - popcount(left)
+
+        # For (in)equalities, only the same value in the neighbour matters
+        value_ids = self.value_ids
+        ids = value_ids[var_id]
+        mask = masks[var_id]
+        for ovar_id in self.inequalities[var_id]:
+            omask = masks[ovar_id]
+            oids = value_ids[ovar_id]
+            if oids is ids and omask:
+                # The values share their bits, so each value in both domains
+                # rules out one value, and a lone value is wiped out
+                for bit in iter_bits(omask & mask):
+                    ruled_out[bit] += 1
+                if not omask & (omask - 1) and omask & mask:
+                    wiped[omask.bit_length() - 1] += 1
+                continue
+            for bit in bits:
+                obit = bit if oids is ids else oids.get(values[bit])
+                if obit is not None and (omask >> obit) & 1:
+                    ruled_out[bit] += 1
+                    if omask == 1 << obit:
+                        wiped[bit] += 1
+                elif not omask:
+                    wiped[bit] += 1
+        for ovar_id in self.equalities[var_id]:
+            omask = masks[ovar_id]
+            oids = value_ids[ovar_id]
+            osize = popcount(omask)
+            for bit in bits:
+                obit = bit if oids is ids else oids.get(values[bit])
+                if obit is not None and (omask >> obit) & 1:
+                    ruled_out[bit] += osize - 1
+                else:
+                    ruled_out[bit] += osize
+                    wiped[bit] += 1
+        return {values[bit]: (wiped[bit], ruled_out[bit]) for bit in bits}
+
     def get_violated_constraints(self, var: Variable, val: Value) -> Set[VarPair]:
         """Return the scopes of the constraints that would be violated by making this assignment."""
+        var_id = self.var_ids[var]
+        bit = self.value_ids[var_id][val]
+        masks = self.domain_masks
         violated = set()
-        for ovar, ovals in self.conflicts[(var, val)].items():
-            any_valid = False
-            for oval in self.current_domains[ovar]:
-                if oval not in ovals:
-                    any_valid = True
-                    break
-            if not any_valid:
-                violated.add((var, ovar))
+        for ovar_id, support in self.supports[var_id].items():
+            if support is None:
+                support = self._build_arc(var_id, ovar_id)
+            if not masks[ovar_id] & support[bit]:
+                violated.add((var, self.var_names[ovar_id]))
+
+        value_ids = self.value_ids
+        for ovar_id in self.inequalities[var_id]:
+            obit = value_ids[ovar_id].get(val)
+            omask = masks[ovar_id]
+            if not omask or (obit is not None and omask == 1 << obit):
+                violated.add((var, self.var_names[ovar_id]))
+        for ovar_id in self.equalities[var_id]:
+            obit = value_ids[ovar_id].get(val)
+            if obit is None or not (masks[ovar_id] >> obit) & 1:
+                violated.add((var, self.var_names[ovar_id]))
         return violated
 
 # -------------------------------------------------------------------------------
 # You should not need to look below this point unless you are interested
 # -------------------------------------------------------------------------------
 
+    def increase_conflict_weights(self, scopes):
+        """ Increase by one the weights (in conflict_weights) of the constraints
+            with the given scopes, in both directions. If learn_weights is set,
+            the search calls this with the constraints which made a value
+            fail, so that the dom/wdeg heuristic prefers variables in
+            constraints which often fail.
+            (CSP, set([(str, str)])) -> None
+        """
+        weights = self.conflict_weights
+        for var, ovar in scopes:
+            weights[(var, ovar)] += 1
+            weights[(ovar, var)] += 1
+
+    def inference_wipeouts(self, var: Variable, pruned_list: List[Pair]) -> Set[VarPair]:
+        """ Return the scopes of the constraints to blame for the domains which
+            pruning the given values after assigning var would wipe out: the
+            constraint with var for each such neighbour of var, and all the
+            constraints of any other such variable, as inference may have
+            emptied it through any of them. The set is empty if no domain
+            would be wiped out.
+            (CSP, str, [(str, str)]) -> set([(str, str)])
+        """
+        removed = {}
+        for ovar, oval in pruned_list:
+            ovar_id = self.var_ids[ovar]
+            bit = self.value_ids[ovar_id].get(oval)
+            if bit is not None:
+                removed[ovar_id] = removed.get(ovar_id, 0) | 1 << bit
+        scopes = set()
+        for ovar_id, mask in removed.items():
+            if self.domain_masks[ovar_id] & ~mask:
+                continue
+            ovar = self.var_names[ovar_id]
+            if var in self.neighbours[ovar]:
+                scopes.add((var, ovar))
+            else:
+                scopes.update((ovar, nvar) for nvar in self.neighbours[ovar])
+        return scopes
+
+    def domain_culprits(self, var: Variable, local: bool = True) -> Set[Variable]:
+        """ Return the assigned variables responsible for removing values from
+            the current domain of the given variable (including itself, if it
+            is assigned). Values removed before any assignment are not blamed
+            on anyone.
+
+            If local is True, a value pruned by inference after an assignment
+            is blamed on that assignment alone, which is right for forward
+            checking. Otherwise it is blamed on that assignment and all the
+            earlier ones, as the inference may have depended on any of them.
+        """
+        var_id = self.var_ids[var]
+        trail = self.trail
+        marks = self.trail_marks
+        levels = set()
+        level = len(marks) - 1
+        for pos in range(self.trail_height - 2, -1, -2):
+            while level >= 0 and marks[level] > pos:
+                level -= 1
+            if level < 0:
+                break
+            if trail[pos] == var_id:
+                if not local:
+                    levels.update(range(level + 1))
+                    break
+                levels.add(level)
+        return set(self.var_names[self.trail_vars[level]] for level in levels)
+
+    def value_mask(self, var, values):
+        """ Return the bitmask of the given values of the given variable.
+            (CSP, str, [str]) -> int
+        """
+        value_ids = self.value_ids[self.var_ids[var]]
+        mask = 0
+        for val in values:
+            mask |= 1 << value_ids[val]
+        return mask
+
     def notify_of_inference(self, var, assignment, pruned_list):
         """ Notify the problem that setting the given variable caused the given
             list of (var, value) pairs to be pruned from domains and the given
@@ -117,53 +603,430 @@ class CSP:
             This method also takes a list of additional assignments made by var,
             so we can undo these later.
 
+            The pruned values are recorded on the trail against the most
+            recent assignment, which should be the one made to var. Values
+            pruned before any assignment (var is None) are never restored.
+
             (CSP, str, {str : str}, [(str, str)]) -> None
         """
+        masks = self.domain_masks
+        trail = self.trail
+        top = self.trail_height
         for ovar, oval in pruned_list:
-            if oval not in self.current_domains[ovar]:
+            ovar_id = self.var_ids[ovar]
+            bit = self.value_ids[ovar_id].get(oval)
+            if bit is None or not (masks[ovar_id] >> bit) & 1:
+                self.trail_height = top
                 raise ValueError("Error: " + oval +
                                  " not in the current domain of " + ovar)
-            self.current_domains[ovar].remove(oval)
-            self.undo_domains[var].add((ovar, oval))
+            masks[ovar_id] ^= 1 << bit
+            if top + 2 > len(trail):
+                trail.extend([0] * len(trail))
+            trail[top] = ovar_id
+            trail[top + 1] = 1 << bit
+            top += 2
+        if self.size_queue is not None:
+            for ovar_id in set(trail[self.trail_height:top:2]):
+                self._queue_size(ovar_id)
+        self.trail_height = top
 
     def make_assignment(self, var, val):
         """ Assign the given variable to the given value and save the information
             so that we can undo the decision.
             (CSP, str, str) -> None
         """
-        self.undo_domains[var] = set([(var, oval)
-                                      for oval in self.current_domains[var] if oval != val])
-        self.undo_assignments[var] = set([var])
-        self.current_domains[var] = set([val])
+        var_id = self.var_ids[var]
+        new_mask = 1 << self.value_ids[var_id][val]
+        top = self.trail_height
+        self.trail_vars.append(var_id)
+        self.trail_marks.append(top)
+        if top + 2 > len(self.trail):
+            self.trail.extend([0] * len(self.trail))
+        self.trail[top] = var_id
+        self.trail[top + 1] = self.domain_masks[var_id] & ~new_mask
+        self.trail_height = top + 2
+        self.domain_masks[var_id] = new_mask
+        if self.size_queue is not None:
+            self.size_queue.remove(var_id)
+        if self.unassigned_degrees is not None:
+            self._update_degrees(var_id, -1)
 
     def clear_assignment(self, var, assignment=None):
         """ Undo the assignment on the given variable and undo and changes to the
-            domains of other variables that resulted.
+            domains of other variables that resulted. Assignments must be
+            undone in the reverse order to which they were made.
             (CSP, str) -> None
         """
-        for ovar, oval in self.undo_domains[var]:
-            self.current_domains[ovar].add(oval)
+        var_id = self.var_ids[var]
+        if not self.trail_vars or self.trail_vars[-1] != var_id:
+            raise ValueError("Error: " + str(var) +
+                             " is not the most recently assigned variable")
+        self.trail_vars.pop()
+        mark = self.trail_marks.pop()
+        masks = self.domain_masks
+        trail = self.trail
+        for pos in range(self.trail_height - 2, mark - 2, -2):
+            masks[trail[pos]] |= trail[pos + 1]
+        if self.lex_ranks is not None and 0 <= self.lex_ranks[var_id] < self.lex_cursor:
+            self.lex_cursor = self.lex_ranks[var_id]
+        if self.size_queue is not None:
+            # The variable is unassigned, so it goes back in the queue, and
+            # the domains restored change size
+            if self.lex_ranks[var_id] >= 0:
+                self.size_queue.priorities[var_id] = 0
+            for ovar_id in set(trail[mark:self.trail_height:2]):
+                self._queue_size(ovar_id)
+        if self.unassigned_degrees is not None:
+            self._update_degrees(var_id, 1)
+        self.trail_height = mark
         if assignment is not None:
-            for ovar in self.undo_assignments[var]:
-                del assignment[ovar]
-        del self.undo_assignments[var]
+            del assignment[var]
+
+    def smallest_domain_variables(self, assignment, first_only=False, ties_by_degree=False):
+        """ Return the variables of `variables` which are not in the assignment
+            and have the smallest current domain, in lexicographic order, or
+            if ties_by_degree is True, from the most unassigned neighbours to
+            the fewest and then in lexicographic order. If first_only is True,
+            only the first of them is returned (this takes constant time,
+            amortised, or O(log n) with ties_by_degree). The list is empty if
+            every variable is assigned.
+
+            The variables in the assignment should be those assigned with
+            make_assignment.
+            (CSP, {str : str}, bool, bool) -> [str]
+        """
+        if self.size_queue is None or self.size_ties_by_degree != ties_by_degree:
+            self._build_size_queue(ties_by_degree)
+        names = self.var_names
+        return [names[var_id] for var_id in self.size_queue.best(
+            lambda var_id: names[var_id] in assignment, first_only)]
+
+    def largest_degree_variables(self, assignment, first_only=False, ties_by_size=False):
+        """ Return the variables of `variables` which are not in the assignment
+            and have the most neighbours not in the assignment, in
+            lexicographic order, or if ties_by_size is True, in order of the
+            size of their (static) domain and then lexicographic order. If
+            first_only is True, only the first of them is returned (this
+            takes O(log n) time, amortised). The list is empty if every
+            variable is assigned.
+
+            The variables in the assignment should be those assigned with
+            make_assignment.
+            (CSP, {str : str}, bool, bool) -> [str]
+        """
+        if self.degree_queue is None or self.degree_ties_by_size != ties_by_size:
+            self._build_degree_queue(ties_by_size)
+        names = self.var_names
+        return [names[var_id] for var_id in self.degree_queue.best(
+            lambda var_id: names[var_id] in assignment, first_only)]
+
+    def unassigned_degree(self, var):
+        """ Return the number of neighbours of the variable which are not
+            assigned (with make_assignment).
+            (CSP, str) -> int
+        """
+        if self.unassigned_degrees is None:
+            self._build_unassigned_degrees()
+        return self.unassigned_degrees[self.var_ids[var]]
+
+    def _reset_queues(self):
+        """ Forget the queues of the heuristics and what they are built from,
+            so that they are built again when next needed.
+            (CSP) -> None
+        """
+        self.size_queue = None
+        self.degree_queue = None
+        self.unassigned_degrees = None
+
+    def first_unassigned_variable(self, assignment):
+        """ Return the first variable of `variables` in lexicographic order
+            which is not in the assignment, or None if they all are. This
+            takes constant time, amortised, as the search resumes where the
+            last call stopped.
+
+            The variables in the assignment should be those assigned with
+            make_assignment, or given in the initial assignment of the
+            search. The search starts again from the first variable when the
+            assignment is smaller than, or does not contain, the variables
+            already passed, so a CSP can be searched again with a new
+            assignment after an earlier search.
+            (CSP, {str : str}) -> str
+        """
+        if self.lex_order is None:
+            self._build_lex_order()
+        order = self.lex_order
+        cursor = self.lex_cursor
+        if (not self.trail_vars or len(assignment) < cursor or
+                cursor and order[cursor - 1] not in assignment):
+            # A new search may have a different initial assignment, or the
+            # CSP may still hold the assignments of an earlier search, so
+            # start again from the first variable
+            cursor = 0
+        while cursor < len(order) and order[cursor] in assignment:
+            cursor += 1
+        self.lex_cursor = cursor
+        return order[cursor] if cursor < len(order) else None
+
+    def lex_domain(self, var):
+        """ Return the values in the current domain of the variable, in
+            lexicographic order.
+            (CSP, str) -> [str]
+        """
+        if self.lex_order is None:
+            self._build_lex_order()
+        var_id = self.var_ids[var]
+        mask = self.domain_masks[var_id]
+        values = self.value_lists[var_id]
+        return [values[bit] for bit in self.lex_value_orders[var_id] if (mask >> bit) & 1]
+
+    def _build_lex_order(self):
+        """ Work out lex_order, lex_ranks and lex_value_orders (see __init__).
+            (CSP) -> None
+        """
+        self.lex_order = sorted(self.variables)
+        self.lex_ranks = [-1] * len(self.var_names)
+        for rank, var in enumerate(self.lex_order):
+            self.lex_ranks[self.var_ids[var]] = rank
+        self.lex_cursor = 0
+
+        # Variables declared together share their value list, and so the
+        # order of their values
+        orders = {}
+        self.lex_value_orders = []
+        for values in self.value_lists:
+            if id(values) not in orders:
+                orders[id(values)] = sorted(range(len(values)), key=values.__getitem__)
+            self.lex_value_orders.append(orders[id(values)])
+
+    def _unassigned_ids(self):
+        """ Return the ids of the variables of `variables` which are not
+            assigned.
+            (CSP) -> [int]
+        """
+        assigned = set(self.trail_vars)
+        return [self.var_ids[var] for var in self.variables
+                if self.var_ids[var] not in assigned]
+
+    def _build_size_queue(self, ties_by_degree):
+        """ Build size_queue (see __init__) from the current domains, with the
+            given kind of tie keys.
+            (CSP, bool) -> None
+        """
+        if self.lex_order is None:
+            self._build_lex_order()
+        if ties_by_degree and self.unassigned_degrees is None:
+            self._build_unassigned_degrees()
+        self.size_ties_by_degree = ties_by_degree
+        self.size_queue = BucketQueue(max(map(len, self.value_lists), default=0) + 1,
+                                      len(self.var_names), len(self.variables))
+        for var_id in self._unassigned_ids():
+            self.size_queue.priorities[var_id] = 0
+            self._queue_size(var_id)
+
+    def _queue_size(self, var_id):
+        """ Move the given variable to the priority of the size of its current
+            domain in size_queue, unless it is not in the queue.
+            (CSP, int) -> None
+        """
+        if self.size_queue.priorities[var_id] < 0:
+            return
+        if self.size_ties_by_degree:
+            key = (-self.unassigned_degrees[var_id], self.lex_ranks[var_id])
+        else:
+            key = self.lex_ranks[var_id]
+        self.size_queue.push(var_id, popcount(self.domain_masks[var_id]), key)
+
+    def _build_unassigned_degrees(self):
+        """ Work out unassigned_degrees (see __init__) from the assignments
+            made so far.
+            (CSP) -> None
+        """
+        var_ids = self.var_ids
+        self.neighbour_ids = [[var_ids[ovar] for ovar in self.neighbours[var]]
+                              for var in self.var_names]
+        assigned = set(self.trail_vars)
+        self.unassigned_degrees = [sum(1 for ovar_id in ovar_ids if ovar_id not in assigned)
+                                   for ovar_ids in self.neighbour_ids]
+
+    def _build_degree_queue(self, ties_by_size):
+        """ Build degree_queue (see __init__), with the given kind of tie keys.
+            (CSP, bool) -> None
+        """
+        if self.lex_order is None:
+            self._build_lex_order()
+        if self.unassigned_degrees is None:
+            self._build_unassigned_degrees()
+        self.degree_ties_by_size = ties_by_size
+        self.degree_queue = BucketQueue(max(map(len, self.neighbour_ids), default=0) + 1,
+                                        len(self.var_names), len(self.variables))
+        for var_id in self._unassigned_ids():
+            self.degree_queue.priorities[var_id] = 0
+            self._queue_degree(var_id)
+
+    def _queue_degree(self, var_id):
+        """ Move the given variable to the priority of its number of unassigned
+            neighbours in degree_queue, unless it is not in the queue.
+            (CSP, int) -> None
+        """
+        queue = self.degree_queue
+        if queue.priorities[var_id] < 0:
+            return
+        priority = len(queue.heaps) - 1 - self.unassigned_degrees[var_id]
+        if self.degree_ties_by_size:
+            key = (len(self.domains[self.var_names[var_id]]), self.lex_ranks[var_id])
+        else:
+            key = self.lex_ranks[var_id]
+        queue.push(var_id, priority, key)
+
+    def _update_degrees(self, var_id, change):
+        """ Add change to the number of unassigned neighbours of each neighbour
+            of the given variable, which has just been assigned (change is -1)
+            or unassigned (change is 1), and update the queues which use
+            these numbers.
+            (CSP, int, int) -> None
+        """
+        degrees = self.unassigned_degrees
+        for ovar_id in self.neighbour_ids[var_id]:
+            degrees[ovar_id] += change
+        if self.size_queue is not None and self.size_ties_by_degree:
+            for ovar_id in self.neighbour_ids[var_id]:
+                self._queue_size(ovar_id)
+        queue = self.degree_queue
+        if queue is None:
+            return
+        if change < 0:
+            queue.remove(var_id)
+        elif self.lex_ranks[var_id] >= 0:
+            queue.priorities[var_id] = 0
+            self._queue_degree(var_id)
+        for ovar_id in self.neighbour_ids[var_id]:
+            self._queue_degree(ovar_id)
 
     def add_variables(self, variables, domain):
         """ Add the given variables to the CSP, which all have the given domain.
             (CSP, [object], [object]) -> None
         """
+        # The values of each variable are interned in declaration order. The
+        # value list and its index are shared by all the variables declared
+        # together, as they are never modified.
+        value_list = list(dict.fromkeys(domain))
+        value_ids = {val: bit for bit, val in enumerate(value_list)}
+        full_mask = (1 << len(value_list)) - 1
+        self._reset_queues()
+        self.lex_order = None
         for var in variables:
-            if var in self.variables:
+            if var in self.var_ids:
                 raise ValueError("Variable already exists: ", str(var))
             if not domain:
                 raise ValueError("Empty domain")
+            self.var_ids[var] = len(self.var_names)
             self.variables.append(var)
+            self.var_names.append(var)
             self.domains[var] = list(domain)
-            self.current_domains[var] = set(domain)
+            self.value_lists.append(value_list)
+            self.value_ids.append(value_ids)
+            self.domain_masks.append(full_mask)
 
             self.neighbours[var] = set()
-            for val in domain:
-                self.conflicts[(var, val)] = {}
+            self.supports.append({})
+            self.inequalities.append(set())
+            self.equalities.append(set())
+
+    def arc_supports(self, var_id, ovar_id):
+        """ Return the support masks of the arc from var_id to ovar_id as a list
+            indexed by the bit positions of var_id, building them if the arc
+            is an (in)equality. There must be a constraint between the two.
+            (CSP, int, int) -> [int]
+        """
+        supports = self.supports[var_id].get(ovar_id)
+        if supports is not None:
+            return supports
+        if ovar_id in self.supports[var_id]:
+            return self._build_arc(var_id, ovar_id)
+        if ovar_id in self.inequalities[var_id]:
+            return self._comparison_supports(var_id, ovar_id, False)
+        if ovar_id in self.equalities[var_id]:
+            return self._comparison_supports(var_id, ovar_id, True)
+        raise ValueError("Error: no constraint between " + self.var_names[var_id] +
+                         " and " + self.var_names[ovar_id])
+
+    def allowed_pairs(self, var0, var1):
+        """ Return the list of pairs of values of the given variables, from
+            their (static) domains, which are allowed by the arc between them.
+            (CSP, str, str) -> [(str, str)]
+        """
+        id0 = self.var_ids[var0]
+        id1 = self.var_ids[var1]
+        supports = self.arc_supports(id0, id1)
+        ids0 = self.value_ids[id0]
+        bits1 = [(val1, self.value_ids[id1][val1]) for val1 in self.domains[var1]]
+        pairs = []
+        for val0 in self.domains[var0]:
+            support = supports[ids0[val0]]
+            pairs.extend((val0, val1) for val1, bit1 in bits1 if (support >> bit1) & 1)
+        return pairs
+
+    def _comparison_supports(self, var_id, ovar_id, same):
+        """ Build the support masks of an equality (same is True) or inequality
+            (same is False) arc from var_id to ovar_id.
+            (CSP, int, int, bool) -> [int]
+        """
+        ovalue_ids = self.value_ids[ovar_id]
+        ofull = (1 << len(self.value_lists[ovar_id])) - 1
+        supports = []
+        for val in self.value_lists[var_id]:
+            obit = ovalue_ids.get(val)
+            same_mask = 0 if obit is None else 1 << obit
+            supports.append(same_mask if same else ofull & ~same_mask)
+        return supports
+
+    def _check_variables(self, variables):
+        """ Raise a value error if any of the given variables is not defined.
+            (CSP, [str]) -> None
+        """
+        for var in variables:
+            if var not in self.var_ids:
+                raise ValueError("Unknown variable: " + str(var))
+
+    def _add_arc(self, var0, var1, supports0=None, supports1=None, same=None):
+        """ Add the arc between the given variables to the conflicts graph.
+            This is either a table, given by the supports in both directions,
+            or an equality (same is True) or inequality (same is False).
+            If the variables already share an arc, we keep the intersection of
+            the two, which in general is a table.
+            (CSP, str, str, [int], [int], bool) -> None
+        """
+        id0 = self.var_ids[var0]
+        id1 = self.var_ids[var1]
+        self.conflict_weights[(var0, var1)] = 1
+        self.conflict_weights[(var1, var0)] = 1
+        existing = var1 in self.neighbours[var0]
+        self.neighbours[var0].add(var1)
+        self.neighbours[var1].add(var0)
+
+        if same is not None:
+            comparisons = self.equalities if same else self.inequalities
+            if not existing:
+                comparisons[id0].add(id1)
+                comparisons[id1].add(id0)
+                return
+            if id1 in comparisons[id0]:
+                return
+            supports0 = self._comparison_supports(id0, id1, same)
+            supports1 = self._comparison_supports(id1, id0, same)
+        if not existing:
+            self.supports[id0][id1] = supports0
+            self.supports[id1][id0] = supports1
+            return
+
+        # There is a previous arc, so we intersect the two as tables.
+        old0 = self.arc_supports(id0, id1)
+        old1 = self.arc_supports(id1, id0)
+        for comparisons in (self.inequalities, self.equalities):
+            comparisons[id0].discard(id1)
+            comparisons[id1].discard(id0)
+        self.supports[id0][id1] = [a & b for a, b in zip(old0, supports0)]
+        self.supports[id1][id0] = [a & b for a, b in zip(old1, supports1)]
 
     def add_constraint(self, var0, var1, value_list):
         """ Add the given constraint to the CSP.
@@ -172,231 +1035,539 @@ class CSP:
             graph. We also take the intersection of the arcs that we generate
             with any previous arcs for var0 and var1.
 
+            In lazy mode, the arc is only built the first time it is needed.
+
             (CSP, str, str, [(str, str)]) -> None
         """
-        if var0 not in self.domains:
-            raise ValueError("Unknown variable: " + str(var0))
-        if var1 not in self.domains:
-            raise ValueError("Unknown variable: " + str(var1))
+        self._check_variables((var0, var1))
+        self.ground_conflicts.append(
+            ("con", (var0, var1), value_list if self.keep_ground_conflicts else None))
 
-        self.ground_conflicts.append((var0, var1, value_list))
-        self.conflict_weights[(var0, var1)] = 1
-        self.conflict_weights[(var1, var0)] = 1
+        id0 = self.var_ids[var0]
+        id1 = self.var_ids[var1]
+        if self.lazy:
+            key = (min(id0, id1), max(id0, id1))
+            if var1 not in self.neighbours[var0]:
+                self.conflict_weights[(var0, var1)] = 1
+                self.conflict_weights[(var1, var0)] = 1
+                self.neighbours[var0].add(var1)
+                self.neighbours[var1].add(var0)
+                self.supports[id0][id1] = None
+                self.supports[id1][id0] = None
+                self.pending_tables[key] = [(id0, value_list)]
+                return
+            if key in self.pending_tables:
+                self.pending_tables[key].append((id0, value_list))
+                return
 
-        allowed_values = set([tuple(x) for x in value_list])
-
-        for var0_val in self.domains[var0]:
-            for var1_val in self.domains[var1]:
-                self.conflicts[(var0, var0_val)][var1] = set()
-                self.conflicts[(var1, var1_val)][var0] = set()
-        for var0_val in self.domains[var0]:
-            for var1_val in self.domains[var1]:
-                if (var0_val, var1_val) not in allowed_values:
-                    vv_pair = (var0, var0_val)
-                    self.conflicts[vv_pair][var1].add(var1_val)
-                    vv_pair = (var1, var1_val)
-                    self.conflicts[vv_pair][var0].add(var0_val)
-        self.neighbours[var0].add(var1)
-        self.neighbours[var1].add(var0)
+        supports0, supports1 = self._table_supports(id0, id1, value_list)
+        self._add_arc(var0, var1, supports0, supports1)
+
+    def _table_supports(self, id0, id1, value_list):
+        """ Build the support masks in both directions of the arc between the
+            given variables which allows the given pairs of values.
+            (CSP, int, int, [(str, str)]) -> ([int], [int])
+        """
+        ids0 = self.value_ids[id0]
+        ids1 = self.value_ids[id1]
+        full0 = (1 << len(self.value_lists[id0])) - 1
+        full1 = (1 << len(self.value_lists[id1])) - 1
+
+        # Only the values currently in the (static) domains take part in the
+        # constraint: each of them starts with no support, and only then are
+        # the allowed pairs added in.
+        mask0 = self.value_mask(self.var_names[id0], self.domains[self.var_names[id0]])
+        mask1 = self.value_mask(self.var_names[id1], self.domains[self.var_names[id1]])
+        supports0 = [full1 & ~mask1 if (mask0 >> bit0) & 1 else full1
+                     for bit0 in range(len(self.value_lists[id0]))]
+        supports1 = [full0 & ~mask0 if (mask1 >> bit1) & 1 else full0
+                     for bit1 in range(len(self.value_lists[id1]))]
+        for val0, val1 in value_list:
+            bit0 = ids0.get(val0)
+            bit1 = ids1.get(val1)
+            if bit0 is None or bit1 is None:
+                continue
+            supports0[bit0] |= 1 << bit1
+            supports1[bit1] |= 1 << bit0
+        return supports0, supports1
 
-        return
+    def _build_arc(self, var_id, ovar_id):
+        """ Build the table of a lazy arc from the constraints waiting for it in
+            pending_tables, and return its supports from var_id to ovar_id.
+            (CSP, int, int) -> [int]
+        """
+        supports = self._pending_supports(var_id, ovar_id)
+        del self.pending_tables[(min(var_id, ovar_id), max(var_id, ovar_id))]
+        self.supports[var_id][ovar_id] = supports[var_id]
+        self.supports[ovar_id][var_id] = supports[ovar_id]
+        return supports[var_id]
+
+    def _pending_supports(self, var_id, ovar_id):
+        """ Work out the supports of a lazy arc from the constraints waiting
+            for it in pending_tables, without storing them, as a dict mapping
+            each of the two variables to its supports towards the other.
+            (CSP, int, int) -> {int : [int]}
+        """
+        supports = {}
+        for first_id, value_list in self.pending_tables[
+                (min(var_id, ovar_id), max(var_id, ovar_id))]:
+            second_id = ovar_id if first_id == var_id else var_id
+            first, second = self._table_supports(first_id, second_id, value_list)
+            if first_id in supports:
+                first = [a & b for a, b in zip(supports[first_id], first)]
+                second = [a & b for a, b in zip(supports[second_id], second)]
+            supports[first_id] = first
+            supports[second_id] = second
+        return supports
 
     def add_inequality(self, var0, var1):
         """ Add an inequality between the given variables. Raises a value error
             if they are not defined.
             (CSP, str, str) -> None
         """
-        value_list = []
-        for val0 in self.domains[var0]:
-            for val1 in self.domains[var1]:
-                if val0 != val1:
-                    value_list.append((val0, val1))
-        self.add_constraint(var0, var1, value_list)
+        self._check_variables((var0, var1))
+        self.ground_conflicts.append(("neq", (var0, var1), None))
+        self._add_arc(var0, var1, same=False)
 
     def add_equality(self, var0, var1):
-        """ Add an inequality between the given variables. Raises a value error
+        """ Add an equality between the given variables. Raises a value error
             if they are not defined.
             (CSP, object, object) -> None
         """
-        value_list = []
-        for val0 in self.domains[var0]:
-            for val1 in self.domains[var1]:
-                if val0 == val1:
-                    value_list.append((val0, val1))
-        self.add_constraint(var0, var1, value_list)
+        self._check_variables((var0, var1))
+        self.ground_conflicts.append(("allsame", (var0, var1), None))
+        self._add_arc(var0, var1, same=True)
+
+    def add_alldiff(self, variables):
+        """ Add the constraint that the given variables all take different
+            values. This is stored as a pairwise inequality between them.
+            Raises a value error if any of them are not defined.
+            (CSP, [str]) -> None
+        """
+        self._check_variables(variables)
+        self.ground_conflicts.append(("alldiff", tuple(variables), None))
+        for var0, var1 in itertools.combinations(variables, 2):
+            self._add_arc(var0, var1, same=False)
+
+    def add_allsame(self, variables):
+        """ Add the constraint that the given variables all take the same
+            value. This is stored as a pairwise equality between them.
+            Raises a value error if any of them are not defined.
+            (CSP, [str]) -> None
+        """
+        self._check_variables(variables)
+        self.ground_conflicts.append(("allsame", tuple(variables), None))
+        for var0, var1 in itertools.combinations(variables, 2):
+            self._add_arc(var0, var1, same=True)
 
     def parse_csp_file(self, csp_file_name):
         """ Parse the given CSP file.
 
             This solver can handle problems with enumerated variables with finite domains.
+
+            The file is parsed in bulk: all the declarations are checked and
+            collected first, then all the variables are added, their domains
+            shrunk by the unary constraints and finally the other constraints
+            are added.
         """
         try:
             with open(csp_file_name) as csp_file:
-                for lid, line in enumerate(csp_file):
-                    line = line.strip()
-                    if not line or line[0] == "%":
-                        continue
-                    tokens = line.split()
-                    if tokens[0] == "var":
-                        try:
-                            sep = tokens.index(":")
-                        except ValueError:
-                            print("Error on line", lid,
-                                  "var definition missing colon")
-                            return False
-                        nvars = tokens[1:sep]
-                        nvals = tokens[sep+1:]
-                        if not nvars:
-                            print("Error on line", lid,
-                                  "var definition has no variables.")
-                            return False
-                        if not nvals:
-                            print("Error on line", lid,
-                                  "var definition has no values.")
-                            return False
-                        try:
-                            self.add_variables(nvars, nvals)
-                        except ValueError:
-                            print(
-                                "Error on line", lid, "var definition contains an already defined variable.")
-                            return False
-
-                    elif tokens[0] == "con":
-                        try:
-                            sep = tokens.index(":")
-                        except ValueError:
-                            print("Error on line", lid,
-                                  "constraint definition missing colon")
-                            return False
-                        nvars = tokens[1:sep]
-                        if not nvars:
-                            print("Error on line", lid,
-                                  "constraint definition has no variables.")
-                            return False
-                        if len(nvars) > 2:
-                            print("Error on line", lid,
-                                  "only binary and unary constraints allowed.")
-                            return False
-
-                        if len(nvars) == 1:
-                            var = nvars[0]
-                            # We do not encode unary constraints, we simply perform an
-                            # implicit node consistency by shrinking the initial domains
-                            # of variables
-                            all_values = set()
-                            values = []
-                            for value in tokens[sep+1:]:
-                                if value == ":":
-                                    if not values:
-                                        print("Error on line", lid,
-                                              "badly formed constraint. Missing values.")
-                                        return False
-                                    if len(values) != len(nvars):
-                                        print("Error on line", lid,
-                                              "badly formed constraint. Wrong number of values.")
-                                        return False
-
-                                    val = values[0]
-                                    if val not in self.domains[var]:
-                                        print("Error on line", lid, "badly formed or",
-                                              "inconsistent unary constraint. Unknown value:", val)
-                                        return False
-                                    all_values.add(val)
-                                    values = []
-                                else:
-                                    values.append(value)
-                            all_values.update(values)
-                            if not all_values:
-                                print("Error on line", lid,
-                                      "badly formed constraint. Missing values.")
-                                return False
-                            new_domain = []
-                            for val in self.domains[var]:
-                                if val in all_values:
-                                    new_domain.append(val)
-                            self.domains[var] = new_domain
-                            self.current_domains[var] = set(new_domain)
-                        else:
-                            all_values = []
-                            values = []
-                            for value in tokens[sep+1:]:
-                                if value == ":":
-                                    if not values:
-                                        print("Error on line", lid,
-                                              "badly formed constraint. Missing values.")
-                                        return False
-                                    if len(values) != len(nvars):
-                                        print("Error on line", lid,
-                                              "badly formed constraint. Wrong number of values.")
-                                        return False
-                                    all_values.append(values)
-                                    values = []
-                                else:
-                                    values.append(value)
-                            if not values:
-                                print("Error on line", lid,
-                                      "badly formed constraint. Missing values.")
-                                return False
-                            all_values.append(values)
-                            self.add_constraint(nvars[0], nvars[1], all_values)
-                    elif tokens[0] == "neq":
-                        nvars = tokens[1:]
-                        if len(nvars) != 2:
-                            print(
-                                "Error on line", lid, "badly formed neq: it needs to involve two variables exactly")
-                            return False
-                        for var1, var2 in itertools.combinations(nvars, 2):
-                            try:
-                                self.add_inequality(var1, var2)
-                            except ValueError as e:
-                                print("Error on line", lid, e.message)
-                                return False
-                    elif tokens[0] == "alldiff":
-                        nvars = tokens[1:]
-                        if len(nvars) < 3:
-                            print("Error on line", lid, "badly formed alldiff")
-                            return False
-                        for var1, var2 in itertools.combinations(nvars, 2):
-                            try:
-                                self.add_inequality(var1, var2)
-                            except ValueError as e:
-                                print("Error on line", lid, e.message)
-                                return False
-
-                    elif tokens[0] == "allsame":
-                        nvars = tokens[1:]
-                        if len(nvars) < 2:
-                            print("Error on line", lid, "badly formed allsame")
-                            return False
-                        for var1, var2 in itertools.combinations(nvars, 2):
-                            try:
-                                self.add_equality(var1, var2)
-                            except ValueError as e:
-                                print("Error on line", lid, e.message)
-                                return False
-
-                    else:
-                        print("Error: unknown constraint on line", lid, ":", line)
-                        return False
-
+                lines = csp_file.read().splitlines()
         except IOError as e:
             print("Error: could not open CSP file: ", csp_file_name)
             return False
 
+        var_lines = []
+        unary_lines = []
+        constraint_lines = []
+        for lid, line in enumerate(lines):
+            tokens = line.split()
+            if not tokens or tokens[0][0] == "%":
+                continue
+            if tokens[0] == "var":
+                try:
+                    sep = tokens.index(":")
+                except ValueError:
+                    print("Error on line", lid,
+                          "var definition missing colon")
+                    return False
+                nvars = tokens[1:sep]
+                nvals = tokens[sep+1:]
+                if not nvars:
+                    print("Error on line", lid,
+                          "var definition has no variables.")
+                    return False
+                if not nvals:
+                    print("Error on line", lid,
+                          "var definition has no values.")
+                    return False
+                var_lines.append((lid, nvars, nvals))
+
+            elif tokens[0] == "con":
+                try:
+                    sep = tokens.index(":")
+                except ValueError:
+                    print("Error on line", lid,
+                          "constraint definition missing colon")
+                    return False
+                nvars = tokens[1:sep]
+                if not nvars:
+                    print("Error on line", lid,
+                          "constraint definition has no variables.")
+                    return False
+                if len(nvars) > 2:
+                    print("Error on line", lid,
+                          "only binary and unary constraints allowed.")
+                    return False
+                all_values = self._split_values(lid, tokens[sep+1:], len(nvars))
+                if all_values is None:
+                    return False
+                if len(nvars) == 1:
+                    # We do not encode unary constraints, we simply perform an
+                    # implicit node consistency by shrinking the initial domains
+                    # of variables
+                    unary_lines.append((lid, nvars[0], [values[0] for values in all_values]))
+                else:
+                    constraint_lines.append((lid, "con", nvars, all_values))
+
+            elif tokens[0] == "neq":
+                nvars = tokens[1:]
+                if len(nvars) != 2:
+                    print(
+                        "Error on line", lid, "badly formed neq: it needs to involve two variables exactly")
+                    return False
+                constraint_lines.append((lid, "neq", nvars, None))
+
+            elif tokens[0] == "alldiff":
+                nvars = tokens[1:]
+                if len(nvars) < 3:
+                    print("Error on line", lid, "badly formed alldiff")
+                    return False
+                constraint_lines.append((lid, "alldiff", nvars, None))
+
+            elif tokens[0] == "allsame":
+                nvars = tokens[1:]
+                if len(nvars) < 2:
+                    print("Error on line", lid, "badly formed allsame")
+                    return False
+                constraint_lines.append((lid, "allsame", nvars, None))
+
+            else:
+                print("Error: unknown constraint on line", lid, ":", line.strip())
+                return False
+        del lines
+
+        for lid, nvars, nvals in var_lines:
+            try:
+                self.add_variables(nvars, nvals)
+            except ValueError:
+                print(
+                    "Error on line", lid, "var definition contains an already defined variable.")
+                return False
+
+        for lid, var, values in unary_lines:
+            if var not in self.var_ids:
+                print("Error on line", lid, "Unknown variable:", var)
+                return False
+            domain = set(self.domains[var])
+            for val in values:
+                if val not in domain:
+                    print("Error on line", lid, "badly formed or",
+                          "inconsistent unary constraint. Unknown value:", val)
+                    return False
+            values = set(values)
+            new_domain = [val for val in self.domains[var] if val in values]
+            self.domains[var] = new_domain
+            self.domain_masks[self.var_ids[var]] = self.value_mask(var, new_domain)
+
+        for pos, (lid, kind, nvars, all_values) in enumerate(constraint_lines):
+            # Drop our reference to the values as soon as they are added, so
+            # they can be freed unless the CSP keeps them.
+            constraint_lines[pos] = None
+            try:
+                if kind == "con":
+                    self.add_constraint(nvars[0], nvars[1], all_values)
+                elif kind == "neq":
+                    self.add_inequality(nvars[0], nvars[1])
+                elif kind == "alldiff":
+                    self.add_alldiff(nvars)
+                else:
+                    self.add_allsame(nvars)
+            except ValueError as e:
+                print("Error on line", lid, e)
+                return False
+
+        self._build_lex_order()
         return True
 
-    def write(self, out_file):
+    def find_interchangeable_values(self):
+        """ Return True if the values of the CSP are interchangeable, that is
+            if every variable has the same domain (of at least two values)
+            and every constraint is unchanged when the values are permuted.
+            Between two variables, the only such constraints are equality,
+            inequality, and the constraints which allow every pair or none.
+            This reads the tables of lazy arcs without building them.
+            (CSP) -> bool
+        """
+        if not self.variables:
+            return False
+        domain = set(self.domains[self.variables[0]])
+        if len(domain) < 2:
+            return False
+        for var in self.variables:
+            if len(self.domains[var]) != len(domain) or not domain.issuperset(self.domains[var]):
+                return False
+
+        for var_id, arcs in enumerate(self.supports):
+            value_ids = self.value_ids[var_id]
+            for ovar_id, supports in arcs.items():
+                if ovar_id < var_id:
+                    continue
+                if supports is None:
+                    supports = self._pending_supports(var_id, ovar_id)[var_id]
+                # Each value must allow the same kind of set of values of the
+                # neighbour: none, just itself, all but itself, or all
+                ovalue_ids = self.value_ids[ovar_id]
+                omask = self.value_mask(self.var_names[ovar_id], domain)
+                kinds = set()
+                for val in domain:
+                    allowed = supports[value_ids[val]] & omask
+                    same = 1 << ovalue_ids[val]
+                    if allowed == 0:
+                        kinds.add("none")
+                    elif allowed == same:
+                        kinds.add("eq")
+                    elif allowed == omask & ~same:
+                        kinds.add("neq")
+                    elif allowed == omask:
+                        kinds.add("all")
+                    else:
+                        return False
+                if len(kinds) > 1:
+                    return False
+        return True
+
+    @staticmethod
+    def _split_values(lid, tokens, arity):
+        """ Split the value tokens of a constraint definition into tuples of
+            arity values. Print an error and return None if they are badly
+            formed.
+            (int, [str], int) -> [(str, ...)]
+        """
+        # Well formed tuples are separated by lone ":" tokens, so they can be
+        # sliced out directly.
+        step = arity + 1
+        if len(tokens) % step == arity and tokens.count(":") == len(tokens) // step \
+                and all(token == ":" for token in tokens[arity::step]):
+            return list(zip(*[tokens[pos::step] for pos in range(arity)]))
+
+        # Otherwise, find out what is wrong to report it
+        values = []
+        for value in tokens + [":"]:
+            if value == ":":
+                if not values:
+                    print("Error on line", lid,
+                          "badly formed constraint. Missing values.")
+                    return None
+                if len(values) != arity:
+                    print("Error on line", lid,
+                          "badly formed constraint. Wrong number of values.")
+                    return None
+                values = []
+            else:
+                values.append(value)
+        return None
+
+    def __getstate__(self):
+        """ Return the state to pickle: the views are not saved, but rebuilt
+            by __setstate__.
+        """
+        state = self.__dict__.copy()
+        del state["current_domains"]
+        del state["conflicts"]
+        return state
+
+    def __setstate__(self, state):
+        """Restore the pickled (or copied) state and rebuild the views."""
+        self.__dict__.update(state)
+        self.conflicts = ConflictView(self)
+        self.current_domains = DomainView(self)
+
+    def fork(self, variables=None):
+        """ Return a new CSP for the same problem, starting from the current
+            domains of this one, which can then be searched independently.
+
+            If variables is given, the fork is the subproblem of just these
+            variables: they must be a union of connected components (see
+            components), so that they have no constraints with the others.
+
+            The fork shares the parts of the CSP which do not change during
+            search (variables, domains, neighbours and the conflicts graph)
+            with this one, and only copies the domain masks and the weights
+            of the constraints, which local search and dom/wdeg increase as
+            they go, so it takes time and memory proportional to the number
+            of variables and constraints.
+            The assignments made so far cannot be undone in the fork: its
+            initial domains are the current domains of this CSP. Neither CSP
+            should have variables or constraints added to it afterwards.
+            (CSP, [str]) -> CSP
+        """
+        clone = copy.copy(self)
+        if variables is not None:
+            clone.variables = list(variables)
+        clone.domain_masks = list(self.domain_masks)
+        clone.conflict_weights = dict(self.conflict_weights)
+        clone._reset_queues()
+        if variables is not None:
+            clone._build_lex_order()
+        clone.trail = [0] * 1024
+        clone.trail_height = 0
+        clone.trail_vars = []
+        clone.trail_marks = []
+        return clone
+
+    def components(self):
+        """ Return the connected components of the constraint graph of the
+            variables of this CSP, each as a list of variables in the order of
+            `variables`, in order of their first variable.
+            (CSP) -> [[str]]
+        """
+        component_of = {}
+        components = []
+        for var in self.variables:
+            if var in component_of:
+                continue
+            index = len(components)
+            component_of[var] = index
+            frontier = [var]
+            while frontier:
+                for ovar in self.neighbours[frontier.pop()]:
+                    if ovar not in component_of:
+                        component_of[ovar] = index
+                        frontier.append(ovar)
+            components.append([])
+        for var in self.variables:
+            components[component_of[var]].append(var)
+        return components
+
+    def save_compiled(self, csp_file_name):
+        """ Save the CSP parsed from the given CSP file to its compiled sidecar
+            (see compiled_file_name), so that it can be loaded again with
+            load_compiled without parsing the file. The header records the
+            lazy and keep_ground_conflicts modes the CSP was built in.
+            (CSP, str) -> None
+        """
+        stat = os.stat(csp_file_name)
+        with open(compiled_file_name(csp_file_name), "wb") as out_file:
+            pickler = pickle.Pickler(out_file, pickle.HIGHEST_PROTOCOL)
+            pickler.dump((COMPILED_VERSION, stat.st_size, stat.st_mtime_ns,
+                          self.lazy, self.keep_ground_conflicts))
+            pickler.dump(self)
+
+    @staticmethod
+    def load_compiled(csp_file_name, lazy=False, keep_ground_conflicts=False):
+        """ Load the CSP of the given CSP file from its compiled sidecar. The
+            sidecar is memory-mapped, and is only used if it was saved by this
+            version of the solver from the current contents of the file, by a
+            CSP made with the given lazy and keep_ground_conflicts arguments
+            (see CSP). Return None if there is no such sidecar.
+            (str, bool, bool) -> CSP
+        """
+        try:
+            stat = os.stat(csp_file_name)
+            with open(compiled_file_name(csp_file_name), "rb") as in_file:
+                with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    unpickler = pickle.Unpickler(data)
+                    header = unpickler.load()
+                    if header != (COMPILED_VERSION, stat.st_size, stat.st_mtime_ns,
+                                  lazy, keep_ground_conflicts):
+                        return None
+                    return unpickler.load()
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def write(self, out_file, compact=True):
         """ Write the CSP to the given file object. To write to stdout do the
             following:
                 import sys
                 csp.write(sys.stdout)
 
-            (CSP, file) -> None
+            The output is buffered and written to the file in large chunks.
+            If compact is True, consecutive variables with the same domain
+            share a var line, and (in)equalities are written as neq, alldiff
+            and allsame lines, as are the binary constraints which allow
+            exactly the pairs of different values. Otherwise each constraint
+            is written as con lines listing its allowed pairs.
+
+            (CSP, file, bool) -> None
         """
-        for var in self.variables:
-            out_file.write("var " + var + " : " +
-                           " ".join(self.domains[var]) + "\n")
-        out_file.write("\n")
-        for var1, var2, values in self.ground_conflicts:
-            out_file.write("con " + var1 + " " + var2 + " : " +
-                           " : ".join([" ".join(vals) for vals in values]) + "\n")
+        buffer = []
+        buffered = 0
+        for line in self._output_lines(compact):
+            buffer.append(line)
+            buffered += len(line)
+            if buffered >= WRITE_CHUNK_SIZE:
+                out_file.write("".join(buffer))
+                buffer = []
+                buffered = 0
+        out_file.write("".join(buffer))
+
+    def _output_lines(self, compact):
+        """ Generate the lines written by write.
+            (CSP, bool) -> iterator of str
+        """
+        if compact:
+            group = []
+            for var in self.variables:
+                if group and self.domains[var] != self.domains[group[0]]:
+                    yield "var " + " ".join(group) + " : " + " ".join(self.domains[group[0]]) + "\n"
+                    group = []
+                group.append(var)
+            if group:
+                yield "var " + " ".join(group) + " : " + " ".join(self.domains[group[0]]) + "\n"
+        else:
+            for var in self.variables:
+                yield "var " + var + " : " + " ".join(self.domains[var]) + "\n"
+        yield "\n"
+
+        regenerated = set()
+        for kind, scope, values in self.ground_conflicts:
+            if kind == "con":
+                if values is None:
+                    # The pairs were not kept, so we list those allowed by the
+                    # table of the arc. This is the intersection of all the
+                    # constraints between the two variables, so we write it once.
+                    if scope in regenerated:
+                        continue
+                    regenerated.add(scope)
+                    values = self.allowed_pairs(*scope)
+                if compact and self._is_inequality(scope[0], scope[1], values):
+                    yield "neq " + scope[0] + " " + scope[1] + "\n"
+                else:
+                    yield "con " + scope[0] + " " + scope[1] + " : " + \
+                        " : ".join([" ".join(vals) for vals in values]) + "\n"
+            elif compact:
+                yield kind + " " + " ".join(scope) + "\n"
+            else:
+                # (In)equalities are expanded into explicit pairs here.
+                for var1, var2 in itertools.combinations(scope, 2):
+                    yield "con " + var1 + " " + var2 + " : " + " : ".join([
+                        val1 + " " + val2 for val1 in self.domains[var1]
+                        for val2 in self.domains[var2]
+                        if (val1 == val2) == (kind == "allsame")]) + "\n"
+
+    def _is_inequality(self, var0, var1, values):
+        """ Return True iff the given allowed pairs of values of the given
+            variables are exactly the pairs of different values from their
+            domains.
+            (CSP, str, str, [(str, str)]) -> bool
+        """
+        domain0 = set(self.domains[var0])
+        domain1 = set(self.domains[var1])
+        pairs = set()
+        for val0, val1 in values:
+            if val0 == val1 and val0 in domain0 and val1 in domain1:
+                return False
+            if val0 in domain0 and val1 in domain1:
+                pairs.add((val0, val1))
+        return len(pairs) == len(domain0) * len(domain1) - len(domain0 & domain1)
@@ -23,6 +23,19 @@ import functools
 Assignment = Dict[str, str]
 
 
+def tie_break_order(items, gamma: CSP) -> List[str]:
+    """Return the items in the order in which a heuristic should consider them.
+
+    The first of several equally good items is chosen, so this is the order
+    which breaks ties: lexicographic order, unless `gamma.rng` is set, in which
+    case the items are shuffled to break ties randomly.
+    """
+    order = sorted(items)
+    if gamma.rng is not None:
+        gamma.rng.shuffle(order)
+    return order
+
+
 # -----------------------------------------------------------------------------
 # Variable Selection Heuristics
 # -----------------------------------------------------------------------------
@@ -49,12 +62,10 @@ def next_variable_lex(assignment: Assignment, gamma: CSP) -> Optional[str]:
         remaining unassigned variables, we return None.
 
     """
-    # gamma.variables is a list of variable names (as strings). See line 43 in
-    # csp.py. We consider them in the order they are added in.
-    for var in sorted(gamma.variables):
-        if var not in assignment:
-            return var
-    return None
+    # The CSP works out the lexicographic order of its variables once (in
+    # gamma.lex_order, not gamma.variables, which is in file order), and
+    # remembers where we stopped looking in it last time.
+    return gamma.first_unassigned_variable(assignment)
 
 
 def next_variable_md(assignment: Assignment, gamma: CSP) -> Optional[str]:
@@ -81,20 +92,13 @@ def next_variable_md(assignment: Assignment, gamma: CSP) -> Optional[str]:
     """
     # *** YOUR CODE HERE ***
     #raise NotImplementedError("Error: MD heuristic not implemented yet!")
-    maxVar = None
-    maxNum = -1
-
-    for var in sorted(gamma.variables):
-        if var not in assignment:
-            neighbour = gamma.neighbours[var]
-            # number is the sum of variable's neighbour which not in assignment
-            number = sum([1 for val in neighbour if val not in assignment])
-            # check if the number is greater than our existing number
-            # we want to choose the largest one
-            if number > maxNum:
-                maxVar = var
-                maxNum = number
-    return maxVar
+    # The CSP keeps the unassigned variables by their number of unassigned
+    # neighbours, so we only look at those with the most
+    if gamma.rng is None:
+        largest = gamma.largest_degree_variables(assignment, first_only=True)
+    else:
+        largest = tie_break_order(gamma.largest_degree_variables(assignment), gamma)
+    return largest[0] if largest else None
 
 def next_variable_mrv(assignment: Assignment, gamma: CSP) -> Optional[str]:
     """Implement the most constrained variable heuristic (MRV).
@@ -119,19 +123,13 @@ def next_variable_mrv(assignment: Assignment, gamma: CSP) -> Optional[str]:
     """
     # *** YOUR CODE HERE ***
     #raise NotImplementedError("Error: MRV heuristic not implemented yet!")
-    minVar = None
-    minNum = sys.maxsize
-    
-    domain = copy.deepcopy(gamma.current_domains)
-    # domain number is the variable to numbers of domains
-    domain_number = {key: len(value) for key, value in domain.items()}
-    for var in sorted(gamma.variables):
-        # here we choose the smallest size of domain
-        if var not in assignment and domain_number[var] < minNum:
-            minVar = var
-            minNum = domain_number[var]
-
-    return minVar
+    # The CSP keeps the unassigned variables by domain size, so we only look
+    # at those with the smallest domain
+    if gamma.rng is None:
+        smallest = gamma.smallest_domain_variables(assignment, first_only=True)
+    else:
+        smallest = tie_break_order(gamma.smallest_domain_variables(assignment), gamma)
+    return smallest[0] if smallest else None
 
 def next_variable_md_mrv(assignment: Assignment, gamma: CSP) -> Optional[str]:
     """Implement MD heuristic, breaking ties with MRV.
@@ -157,23 +155,16 @@ def next_variable_md_mrv(assignment: Assignment, gamma: CSP) -> Optional[str]:
     """
     # *** YOUR CODE HERE ***
     #raise NotImplementedError("Error: MD/MRV heuristic not implemented yet!")
-    maxVar = None
-    maxNum = -1
-    # implement the MD first
-    for var in sorted(gamma.variables):
-        if var not in assignment:
-            neighbour = gamma.neighbours[var]
-            number = sum([1 for val in neighbour if val not in assignment])
-            if number > maxNum:
-                maxVar = var
-                maxNum = number
-            # if they have same number:
-            # then implement the MRV
-            elif number == maxNum:
-                if len(gamma.domains[var]) < len(gamma.domains[maxVar]):
-                    maxVar = var
-                    maxNum = number
-    return maxVar
+    # implement the MD first, and break its ties by domain size: the CSP
+    # keeps the variables with the most unassigned neighbours in that order
+    if gamma.rng is None:
+        largest = gamma.largest_degree_variables(assignment, first_only=True,
+                                                 ties_by_size=True)
+        return largest[0] if largest else None
+    largest = tie_break_order(gamma.largest_degree_variables(assignment), gamma)
+    if not largest:
+        return None
+    return min(largest, key=lambda var: len(gamma.domains[var]))
 
 
 def next_variable_mrv_md(assignment: Assignment, gamma: CSP) -> Optional[str]:
@@ -200,24 +191,73 @@ def next_variable_mrv_md(assignment: Assignment, gamma: CSP) -> Optional[str]:
     """
     # *** YOUR CODE HERE ***
     #raise NotImplementedError("Error: MRV/MD heuristic not implemented yet!")
-    minVar = None
-    minNum = float('inf')
+    # The CSP keeps the variables with the smallest domain in order of their
+    # number of unassigned neighbours
+    if gamma.rng is None:
+        smallest = gamma.smallest_domain_variables(assignment, first_only=True,
+                                                   ties_by_degree=True)
+        return smallest[0] if smallest else None
+
+    maxVar = None
+    maxNum = -1
+    smallest = tie_break_order(gamma.smallest_domain_variables(assignment), gamma)
+    for var in smallest:
+        number = gamma.unassigned_degree(var)
+        if number > maxNum:
+            maxVar = var
+            maxNum = number
+
+    return maxVar
+
+
+def next_variable_domwdeg(assignment: Assignment, gamma: CSP) -> Optional[str]:
+    """Implement the dom/wdeg heuristic.
+
+    Choose the variable with the smallest ratio of its current domain size to
+    its weighted degree: the sum of the weights (in `gamma.conflict_weights`)
+    of its constraints with unassigned variables. The search increases the
+    weight of a constraint each time it makes a value fail, so this learns
+    which parts of the problem are hard, and tackles them first. A variable
+    with no constraints left comes last. Break ties by lexicographic order.
 
-    for var in sorted(gamma.variables):
+    Parameters
+    ----------
+    assignment : Dict[str, str]
+        A Python dictionary that maps variable names to values.
+    gamma : CSP
+        An instance of the class CSP, representing the constraint network
+        to which we are looking for a solution.
+
+    Returns
+    -------
+    variable : Optional[str]
+        The name of the variable chosen by this heuristic. If there are no
+        remaining unassigned variables, we return None.
+
+    """
+    # The CSP keeps its variables in lexicographic order, so only the tied
+    # variables need shuffling to break ties randomly
+    minVars = []
+    minRatio = float('inf')
+    weights = gamma.conflict_weights
+    neighbours = gamma.neighbours
+    order = gamma.lex_order if gamma.lex_order is not None else sorted(gamma.variables)
+
+    for var in order:
         if var not in assignment:
-            if len(gamma.current_domains[var]) < minNum:
-                minVar = var
-                minNum = len(gamma.current_domains[var])
-            elif len(gamma.current_domains[var]) == minNum:
-                neighbour_origin = gamma.neighbours[minVar]
-                neighbour_next = gamma.neighbours[var]
-                origin_num = sum([1 for val in neighbour_origin if val not in assignment])
-                next_num = sum([1 for val in neighbour_next if val not in assignment])
-                if next_num > origin_num:
-                    minVar = var
-                    minNum = len(gamma.current_domains[var])
+            wdeg = sum(weights[(var, ovar)] for ovar in neighbours[var] if ovar not in assignment)
+            ratio = len(gamma.current_domains[var]) / wdeg if wdeg else float('inf')
+            if not minVars or ratio < minRatio:
+                minVars = [var]
+                minRatio = ratio
+            elif ratio == minRatio:
+                minVars.append(var)
 
-    return minVar
+    if not minVars:
+        return None
+    if gamma.rng is not None and len(minVars) > 1:
+        return gamma.rng.choice(minVars)
+    return minVars[0]
 
 
 # -----------------------------------------------------------------------------
@@ -251,8 +291,9 @@ def value_ordering_lex(var: str, assignment: Assignment, gamma: CSP) -> List[str
         variable, sorted according to this heuristic.
 
     """
-    # We need to explicitly convert a set to a list.
-    return sorted(gamma.current_domains[var])
+    # The CSP knows the lexicographic order of the values of each variable,
+    # so we do not need to sort them.
+    return gamma.lex_domain(var)
 
 
 def value_ordering_lcvf(var: str, assignment: Assignment, gamma: CSP) -> List[str]:
@@ -289,21 +330,54 @@ def value_ordering_lcvf(var: str, assignment: Assignment, gamma: CSP) -> List[st
     # *** YOUR CODE HERE ***
     #raise NotImplementedError("Error: LCVF heuristic not implemented yet!")
 
-    domain = sorted(copy.deepcopy(gamma.current_domains[var]))
+    # The CSP works out the effect of every value in one pass. A value which
+    # would wipe out the domain of a neighbour is bound to fail, so those go
+    # last; the others go by how many values they rule out. The sort is
+    # stable, so ties keep the lexicographic (or shuffled) order.
+    if gamma.rng is None:
+        domain = gamma.lex_domain(var)
+    else:
+        domain = tie_break_order(gamma.current_domains[var], gamma)
+    impacts = gamma.value_impacts(var)
+    return sorted(domain, key=lambda val: (impacts[val][0] > 0, impacts[val][1]))
+
+def value_ordering_symmetry(order_domain_values: Callable, var: str,
+                            assignment: Assignment, gamma: CSP) -> List[str]:
+    """Order the values with order_domain_values, breaking value symmetry.
+
+    If the values of `gamma` are interchangeable (see
+    `CSP.find_interchangeable_values`), then all the values which no variable
+    has been assigned yet are alike: if one of them fails, so do the others,
+    as swapping them gives the same subproblem. So only the first of them is
+    kept, along with the values already used. Otherwise, the values are returned
+    as order_domain_values orders them.
+
+    Use `break_value_symmetry` to make a value ordering function of this.
+    """
+    values = order_domain_values(var, assignment, gamma)
+    if not gamma.interchangeable_values:
+        return values
+    used = set(assignment.values())
     solution = []
-    while len(domain) > 0:
-        minVal = None
-        minNum = float('inf')
-        for val in domain:
-            conflicts = gamma.count_conflicts(var, val)
-            if conflicts < minNum:
-                minNum = conflicts
-                minVal = val
-        solution.append(minVal)
-        domain.remove(minVal)
-    
+    unused_kept = False
+    for val in values:
+        if val in used:
+            solution.append(val)
+        elif not unused_kept:
+            solution.append(val)
+            unused_kept = True
     return solution
 
+
+def break_value_symmetry(order_domain_values: Callable) -> Callable:
+    """Return a value ordering function which breaks value symmetry.
+
+    See `value_ordering_symmetry`. The function can be pickled, so it can be
+    given to worker processes.
+    """
+    return functools.partial(value_ordering_symmetry, order_domain_values)
+
+
 # -------------------------------------------------------------------------------
 # Functions used by the system to select from the above heuristics for the search
 # You do not need to look any further.
@@ -321,6 +395,8 @@ def get_variable_selection_function(variable_heuristic: str) -> Callable:
         return next_variable_md_mrv
     if variable_heuristic == "mrv-md":
         return next_variable_mrv_md
+    if variable_heuristic == "domwdeg":
+        return next_variable_domwdeg
 
     raise ValueError(f"Error: the variable selection heuristic "
                      f"'{variable_heuristic}' is not supported")
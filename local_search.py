@@ -0,0 +1,228 @@
+# COMP3620/6320 Artificial Intelligence
+# The Australian National University
+# Authors: COMP-3620 team
+# Date:    2021
+
+""" This file implements min-conflicts local search.
+
+    Every variable always has a value. At each step we pick a variable in
+    conflict and move it to the other value with the fewest conflicts, if
+    that is no worse than its current value. To get out
+    of local minima and plateaus:
+        - a variable may not go back to a value it just left for a few steps
+          (the tabu list), unless that value has no conflicts at all;
+        - now and then a random value is chosen instead (a random walk);
+        - when every other value would increase the conflicts of the
+          variable, it stays, and the weights (in csp.conflict_weights) of
+          the constraints it violates are increased instead, so conflicts
+          which keep coming back cost more.
+
+    Conflicts are counted by weight. For each variable, we keep the weighted
+    number of conflicts every one of its values would have given the current
+    values of its neighbours, and update these counts when a neighbour moves,
+    so a step only costs time for the neighbours of the variable moved.
+"""
+
+import random
+import time
+
+from backtracking_search import INTERRUPT_INTERVAL, UNKNOWN, interrupted
+from csp import iter_bits
+
+# The probability that a step moves to a random value
+WALK_PROBABILITY = 0.02
+
+# The number of steps for which a variable may not go back to a value it left
+TABU_TENURE = 10
+
+
+def search(csp, initial_assignment, select_unassigned_variable,
+           order_domain_values, max_steps, deadline=None, cancel=None):
+    """ Do min-conflicts local search on the CSP for at most max_steps steps.
+
+        The variables in the initial assignment keep their values; every other
+        variable takes values from its current domain. Local search picks its
+        own moves, so the variable and value heuristics are not used. The
+        random number generator is csp.rng if it is set, otherwise the random
+        module.
+
+        Return the assignment found as a solution, the number of steps taken
+        and the search time. Local search cannot prove that there is no
+        solution, so if none is found within max_steps steps, or before the
+        deadline passes or the cancel token is set (see
+        backtracking_search.interrupted), UNKNOWN will be returned in place of
+        the solution. None is only returned if a variable has no values left.
+
+        (CSP, {str : str}, function, function, int) -> ({str : str}, int, float)
+    """
+    start_time = time.time()
+    rng = csp.rng if csp.rng is not None else random
+    weights = csp.conflict_weights
+    var_ids = csp.var_ids
+
+    # candidates[id] is the mask of the values the variable may take, and
+    # arcs[id] lists (neighbour id, supports from id to it, supports from it
+    # to id, weight key) for each of its neighbours
+    candidates = {}
+    arcs = {}
+    for var in csp.variables:
+        var_id = var_ids[var]
+        if var in initial_assignment:
+            candidates[var_id] = 1 << csp.value_ids[var_id][initial_assignment[var]]
+        else:
+            candidates[var_id] = csp.domain_masks[var_id]
+        if not candidates[var_id]:
+            return _finish(None, 0, start_time)
+    for var in csp.variables:
+        var_id = var_ids[var]
+        arcs[var_id] = [(var_ids[ovar], csp.arc_supports(var_id, var_ids[ovar]),
+                         csp.arc_supports(var_ids[ovar], var_id), (var, ovar))
+                        for ovar in csp.neighbours[var] if var_ids[ovar] in candidates]
+
+    # scores[id][bit] is the weighted number of conflicts the variable would
+    # have with the value at bit, and values[id] is the bit of its value
+    scores = {var_id: [0] * len(csp.value_lists[var_id]) for var_id in candidates}
+    values = {}
+
+    def shift(var_id, old_bit, new_bit):
+        """ Move the variable from old_bit (None if it had no value yet) to
+            new_bit, updating the scores of its neighbours.
+        """
+        for ovar_id, supports, _, key in arcs[var_id]:
+            omask = candidates[ovar_id]
+            new = omask & ~supports[new_bit]
+            old = omask & ~supports[old_bit] if old_bit is not None else 0
+            if new == old:
+                continue
+            weight = weights[key]
+            oscores = scores[ovar_id]
+            for obit in iter_bits(old & ~new):
+                oscores[obit] -= weight
+            for obit in iter_bits(new & ~old):
+                oscores[obit] += weight
+        values[var_id] = new_bit
+
+    # Start from a greedy assignment, placing the variables in random order
+    order = list(candidates)
+    rng.shuffle(order)
+    for var_id in order:
+        shift(var_id, None, _best_bit(scores[var_id], candidates[var_id], rng))
+
+    # The movable variables in conflict, as a list (for random choice) and
+    # the position of each in it
+    movable = [var_ids[var] for var in csp.variables if var not in initial_assignment]
+    conflicted = []
+    positions = {}
+
+    def update(var_id):
+        """Add the variable to, or remove it from, the conflicted list."""
+        in_conflict = scores[var_id][values[var_id]] > 0
+        if in_conflict and var_id not in positions:
+            positions[var_id] = len(conflicted)
+            conflicted.append(var_id)
+        elif not in_conflict and var_id in positions:
+            last = conflicted.pop()
+            pos = positions.pop(var_id)
+            if last != var_id:
+                conflicted[pos] = last
+                positions[last] = pos
+
+    fixed = set(candidates).difference(movable)
+    for var_id in movable:
+        update(var_id)
+
+    tabu = {}
+    step = 0
+    while conflicted and step < max_steps:
+        if step % INTERRUPT_INTERVAL == 0 and interrupted(deadline, cancel):
+            break
+        step += 1
+        var_id = rng.choice(conflicted)
+        var_scores = scores[var_id]
+        current = values[var_id]
+        mask = candidates[var_id] & ~(1 << current)
+        if not mask:
+            # The variable has nowhere to go, so make its conflicts cost more
+            _bump_weights(var_id, arcs, values, candidates, scores, weights)
+            continue
+
+        if rng.random() < WALK_PROBABILITY:
+            bits = list(iter_bits(mask))
+            new_bit = bits[rng.randrange(len(bits))]
+        else:
+            allowed = 0
+            for bit in iter_bits(mask):
+                if tabu.get((var_id, bit), 0) < step or var_scores[bit] == 0:
+                    allowed |= 1 << bit
+            if not allowed:
+                continue
+            new_bit = _best_bit(var_scores, allowed, rng)
+            if var_scores[new_bit] > var_scores[current]:
+                # Every move would make things worse, so this is a local
+                # minimum: make the conflicts of the variable cost more
+                _bump_weights(var_id, arcs, values, candidates, scores, weights)
+                continue
+
+        tabu[(var_id, current)] = step + TABU_TENURE
+        shift(var_id, current, new_bit)
+        update(var_id)
+        for ovar_id, _, _, _ in arcs[var_id]:
+            if ovar_id not in fixed:
+                update(ovar_id)
+
+    if conflicted:
+        return _finish(UNKNOWN, step, start_time)
+    assignment = {var: csp.value_lists[var_ids[var]][values[var_ids[var]]]
+                  for var in csp.variables}
+    return _finish(assignment, step, start_time)
+
+
+def _best_bit(var_scores, mask, rng):
+    """ Return the bit in mask with the lowest score, breaking ties randomly.
+
+        ([int], int, random.Random) -> int
+    """
+    best = []
+    best_score = None
+    for bit in iter_bits(mask):
+        score = var_scores[bit]
+        if best_score is None or score < best_score:
+            best = [bit]
+            best_score = score
+        elif score == best_score:
+            best.append(bit)
+    return best[rng.randrange(len(best))]
+
+
+def _bump_weights(var_id, arcs, values, candidates, scores, weights):
+    """ Increase by one the weights of the constraints the variable violates
+        with its current value, updating the scores on both sides.
+    """
+    bit = values[var_id]
+    for ovar_id, supports, osupports, key in arcs[var_id]:
+        obit = values[ovar_id]
+        if (supports[bit] >> obit) & 1:
+            continue
+        weights[key] += 1
+        weights[(key[1], key[0])] += 1
+        for obit2 in iter_bits(candidates[ovar_id] & ~supports[bit]):
+            scores[ovar_id][obit2] += 1
+        for bit2 in iter_bits(candidates[var_id] & ~osupports[obit]):
+            scores[var_id][bit2] += 1
+
+
+def _finish(assignment, n_steps, start_time):
+    """ Print how the search ended and return its result.
+
+        (object, int, float) -> (object, int, float)
+    """
+    if assignment is None:
+        print("No solution!")
+    elif assignment == UNKNOWN:
+        print("No solution found after", n_steps, "steps!")
+    else:
+        print("Solved problem!")
+    print("Steps:", n_steps)
+    soln_time = time.time() - start_time
+    print("Time:", soln_time)
+    return assignment, n_steps, soln_time
@@ -0,0 +1,120 @@
+# COMP3620/6320 Artificial Intelligence
+# The Australian National University
+# Authors: COMP-3620 team
+# Date:    2021
+
+""" This file contains a class NogoodStore, which stores the nogoods learned
+    during search.
+
+    A nogood is a set of (variable, value) pairs, called literals, which
+    cannot all hold in a solution. A literal is true when its variable is
+    assigned its value.
+
+    Each nogood watches two of its literals. We keep the watches away from the
+    true literals where we can, so that a nogood can only forbid a value when
+    it watches the literal of that value: if all the other literals of a
+    nogood are true, the value is forbidden. As assignments are undone in
+    the reverse order in which they were made, the watches never have to be
+    moved back when we backtrack.
+
+    The store is bounded: when it is full, the least recently used nogood is
+    evicted to make room for a new one.
+"""
+
+import collections
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+Literal = Tuple[str, str]
+Nogood = frozenset
+
+
+class NogoodStore:
+    """ A bounded store of nogoods, indexed by their watched literals. """
+
+    def __init__(self, capacity: int = 10000):
+        """Make a new empty store, which keeps at most capacity nogoods."""
+        self.capacity = capacity
+
+        # Each nogood maps to the list of its two watched literals (the same
+        # literal twice for a nogood of one literal). The nogoods are kept in
+        # order of use, with the least recently used first.
+        self.nogoods: Dict[Nogood, List[Literal]] = collections.OrderedDict()
+
+        # The nogoods watching each literal
+        self.watches: Dict[Literal, Set[Nogood]] = {}
+
+        # How many nogoods have been learned and evicted so far
+        self.n_learned = 0
+        self.n_evicted = 0
+
+    def __len__(self):
+        return len(self.nogoods)
+
+    def learn(self, literals: Iterable[Literal]) -> None:
+        """ Store the nogood made of the given literals, which must all be true,
+            given from the most recently assigned to the least recently
+            assigned. The two most recent ones are watched, as they will be
+            the first to stop being true when we backtrack.
+        """
+        literals = list(literals)
+        if not literals or self.capacity <= 0:
+            return
+        nogood = frozenset(literals)
+        if nogood in self.nogoods:
+            self.nogoods.move_to_end(nogood)
+            return
+        if len(self.nogoods) >= self.capacity:
+            self._evict()
+        watched = [literals[0], literals[1] if len(literals) > 1 else literals[0]]
+        self.nogoods[nogood] = watched
+        for literal in watched:
+            self.watches.setdefault(literal, set()).add(nogood)
+        self.n_learned += 1
+
+    def _evict(self) -> None:
+        """Remove the least recently used nogood from the store."""
+        nogood, watched = self.nogoods.popitem(last=False)
+        for literal in watched:
+            watching = self.watches.get(literal)
+            if watching is not None:
+                watching.discard(nogood)
+                if not watching:
+                    del self.watches[literal]
+        self.n_evicted += 1
+
+    def assign(self, var: str, val: str, assignment: Dict[str, str]) -> None:
+        """ Tell the store that var has just been assigned val (which must be
+            in the assignment), so that the nogoods watching it can move their
+            watch to a literal which is not true, if they have one.
+        """
+        literal = (var, val)
+        watching = self.watches.get(literal)
+        if not watching:
+            return
+        for nogood in list(watching):
+            watched = self.nogoods[nogood]
+            other = watched[1] if watched[0] == literal else watched[0]
+            for new in nogood:
+                if new != literal and new != other and assignment.get(new[0]) != new[1]:
+                    watched[watched.index(literal)] = new
+                    watching.discard(nogood)
+                    self.watches.setdefault(new, set()).add(nogood)
+                    break
+        if not watching:
+            del self.watches[literal]
+
+    def forbids(self, var: str, val: str, assignment: Dict[str, str]) -> Optional[Nogood]:
+        """ Return a nogood which forbids assigning val to var given the
+            assignment, that is one with all its other literals true, or None
+            if there is no such nogood.
+        """
+        literal = (var, val)
+        for nogood in self.watches.get(literal, ()):
+            watched = self.nogoods[nogood]
+            other = watched[1] if watched[0] == literal else watched[0]
+            if other != literal and assignment.get(other[0]) != other[1]:
+                continue
+            if all(assignment.get(ovar) == oval for ovar, oval in nogood if ovar != var):
+                self.nogoods.move_to_end(nogood)
+                return nogood
+        return None
@@ -0,0 +1,227 @@
+# COMP3620/6320 Artificial Intelligence
+# The Australian National University
+# Authors: COMP-3620 team
+# Date:    2021
+
+""" This file implements parallel backtracking search, which splits the
+    search tree between several worker processes.
+
+    The top levels of the tree are expanded first, and each node found there
+    becomes a job: its decisions, the (variable, value) pairs on the path to
+    it from the root. A worker searches the subtree under a job with
+    backtracking_search.search, starting from its decisions. The subtrees are
+    disjoint, so the CSP has no solution iff none of them has one.
+
+    The jobs can take very different times, so a worker which runs out of
+    jobs does not just wait: busy workers regularly check whether any worker
+    is waiting, and if so give away the values they have not tried yet at
+    their shallowest level as new jobs.
+"""
+
+import multiprocessing
+import queue
+import time
+
+import backtracking_search
+from inference import get_inference_function
+
+# The tree is split until there are this many jobs per worker
+JOBS_PER_WORKER = 4
+
+
+def _assume(csp, decisions, assignment, inference):
+    """ Make the assignments of the decisions in order, doing inference after
+        each, as search would. Return True if there was no conflict. Otherwise
+        undo them and return False.
+
+        (CSP, [(str, str)], {str : str}, function) -> bool
+    """
+    for n_made, (var, val) in enumerate(decisions):
+        if not csp.count_conflicts(var, val):
+            csp.make_assignment(var, val)
+            assignment[var] = val
+            pruned_list = inference(var, assignment, csp)
+            if pruned_list is not None:
+                csp.notify_of_inference(var, assignment, pruned_list)
+                continue
+            csp.clear_assignment(var, assignment)
+        _retract(csp, decisions[:n_made], assignment)
+        return False
+    return True
+
+
+def _retract(csp, decisions, assignment):
+    """ Undo the assignments made by _assume for the decisions.
+
+        (CSP, [(str, str)], {str : str}) -> None
+    """
+    for var, _ in reversed(decisions):
+        csp.clear_assignment(var, assignment)
+
+
+def split(csp, initial_assignment, select_unassigned_variable,
+          order_domain_values, inference, n_jobs):
+    """ Expand the top levels of the search tree, one level at a time, until
+        there are at least n_jobs nodes at the current level.
+
+        Return the decisions of the nodes at that level, the number of nodes
+        expanded and, if a solution was found on the way, that solution
+        (otherwise None).
+
+        (CSP, {str : str}, ...) -> ([[(str, str)]], int, {str : str})
+    """
+    jobs = [[]]
+    n_expanded_nodes = 0
+    while jobs and len(jobs) < n_jobs:
+        children = []
+        for decisions in jobs:
+            assignment = dict(initial_assignment)
+            _assume(csp, decisions, assignment, inference)
+            var = select_unassigned_variable(assignment, csp)
+            if var is None:
+                return [], n_expanded_nodes, assignment
+            for val in order_domain_values(var, assignment, csp):
+                n_expanded_nodes += 1
+                child = decisions + [(var, val)]
+                if _assume(csp, child[-1:], assignment, inference):
+                    children.append(child)
+                    _retract(csp, child[-1:], assignment)
+            _retract(csp, decisions, assignment)
+        jobs = children
+    return jobs, n_expanded_nodes, None
+
+
+class _Donor:
+    """ Gives the work donated by the search of a worker back to the master
+        process, as new jobs.
+    """
+
+    def __init__(self, results, n_waiting):
+        self.results = results
+        self.n_waiting = n_waiting
+        # The decisions of the job being searched
+        self.decisions = []
+
+    def wanted(self):
+        """Return True if some worker will be left without a job."""
+        return self.n_waiting.value > 0
+
+    def give(self, jobs):
+        """Send the donated jobs, below the current job, to the master."""
+        with self.n_waiting.get_lock():
+            self.n_waiting.value -= len(jobs)
+        self.results.put(("jobs", [self.decisions + decisions for decisions in jobs]))
+
+
+def _run_worker(csp, initial_assignment, select_unassigned_variable,
+                order_domain_values, inference_type, jobs, results, n_waiting):
+    """ Search the subtrees of the jobs taken from the jobs queue, one after
+        the other, with the named inference, and put ("done", solution, nodes
+        expanded) on the results queue for each, where solution is None if
+        there is none.
+    """
+    # The inference is passed by name, as the function for no inference is
+    # local to get_inference_function and cannot be pickled
+    inference = get_inference_function(inference_type)
+    donor = _Donor(results, n_waiting)
+    while True:
+        with n_waiting.get_lock():
+            n_waiting.value += 1
+        decisions = jobs.get()
+        if decisions is None:
+            return
+
+        assignment = dict(initial_assignment)
+        if not _assume(csp, decisions, assignment, inference):
+            results.put(("done", None, 0))
+            continue
+        donor.decisions = decisions
+        solution, explored, _ = backtracking_search.search(
+            csp, assignment, select_unassigned_variable, order_domain_values,
+            inference, verbose=False, donor=donor)
+        if solution is None:
+            _retract(csp, decisions, assignment)
+        results.put(("done", solution, explored))
+
+
+def search(csp, initial_assignment, select_unassigned_variable,
+           order_domain_values, inference_type, n_workers, deadline=None):
+    """ Do backtracking search on the CSP with n_workers worker processes,
+        doing the named inference (see get_inference_function) during search.
+
+        Return the assignment found as a solution, the number of nodes expanded
+        (by all the workers, until the answer was known) and the search time.
+        If no solution can be found, None will be returned in place of the
+        solution. If the answer is not known by the deadline (a time.time()
+        value), the workers are stopped and UNKNOWN is returned, with the
+        nodes expanded by the jobs finished so far.
+
+        (CSP, {str : str}, ..., str, int) -> ({str : str}, int, float)
+    """
+    start_time = time.time()
+    inference = get_inference_function(inference_type)
+    first_jobs, n_expanded_nodes, solution = split(
+        csp, initial_assignment, select_unassigned_variable, order_domain_values,
+        inference, n_workers * JOBS_PER_WORKER)
+    print("Split the search into", len(first_jobs), "jobs")
+
+    if solution is None and first_jobs:
+        context = multiprocessing.get_context()
+        jobs = context.Queue()
+        results = context.Queue()
+        # The number of workers waiting for a job, less the jobs queued
+        n_waiting = context.Value("i", -len(first_jobs))
+        for decisions in first_jobs:
+            jobs.put(decisions)
+        workers = []
+        for _ in range(n_workers):
+            worker = context.Process(
+                target=_run_worker, daemon=True,
+                args=(csp, initial_assignment, select_unassigned_variable,
+                      order_domain_values, inference_type, jobs, results, n_waiting))
+            worker.start()
+            workers.append(worker)
+
+        try:
+            n_unfinished = len(first_jobs)
+            while n_unfinished:
+                if backtracking_search.interrupted(deadline, None):
+                    solution = backtracking_search.UNKNOWN
+                    break
+                timeout = 1 if deadline is None else min(1, max(0, deadline - time.time()))
+                try:
+                    message = results.get(timeout=timeout)
+                except queue.Empty:
+                    # A worker which died will never finish its job
+                    if all(worker.is_alive() for worker in workers):
+                        continue
+                    raise SystemExit("[Fatal]: a parallel search worker stopped unexpectedly")
+                if message[0] == "jobs":
+                    # The donor did not expand the node of each donated value,
+                    # and its new worker only replays it, so count it here
+                    n_unfinished += len(message[1])
+                    n_expanded_nodes += len(message[1])
+                    for decisions in message[1]:
+                        jobs.put(decisions)
+                    continue
+                _, solution, explored = message
+                n_expanded_nodes += explored
+                n_unfinished -= 1
+                if solution is not None:
+                    break
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+
+    if solution is None:
+        print("No solution!")
+    elif solution == backtracking_search.UNKNOWN:
+        print("Stopped without an answer!")
+    else:
+        print("Solved problem!")
+    print("Nodes expanded:", n_expanded_nodes)
+    soln_time = time.time() - start_time
+    print("Time:", soln_time)
+    return solution, n_expanded_nodes, soln_time
@@ -0,0 +1,156 @@
+# COMP3620/6320 Artificial Intelligence
+# The Australian National University
+# Authors: COMP-3620 team
+# Date:    2021
+
+""" This file implements portfolio solving: several worker processes search
+    the same CSP with different configurations at the same time, and the
+    first one to find a solution, or prove there is none, wins. The other
+    workers are then stopped.
+
+    No single combination of search algorithm, heuristics and restarts is
+    the best on every problem, so the portfolio takes about as long as its
+    best member does on each problem, given one core per worker. Every worker
+    uses the inference asked for by the user, as it decides which problems
+    the search can prove to have no solution.
+"""
+
+import multiprocessing
+import queue
+import random
+import time
+
+import backtracking_search
+from heuristics import get_value_ordering_function, get_variable_selection_function
+from inference import get_inference_function
+from nogoods import NogoodStore
+
+# The configurations of the workers, as
+# (search, variable heuristic, value heuristic, restart schedule) tuples,
+# where the search is "backtracking" or "cbj" and the restart schedule is
+# None for no restarts. If there are more workers than configurations, the
+# configurations are used again, with restarts, so that different seeds make
+# the workers search differently.
+CONFIGURATIONS = [
+    ("backtracking", "mrv-md", "lex", None),
+    ("cbj", "mrv", "lex", None),
+    ("backtracking", "md-mrv", "lcvf", None),
+    ("backtracking", "mrv-md", "lex", "luby"),
+    ("cbj", "mrv-md", "lcvf", "luby"),
+    ("backtracking", "mrv", "lex", "geometric"),
+]
+
+# The capacity of the nogood store of the CBJ workers
+NOGOOD_CAPACITY = 10000
+
+
+def worker_configuration(index):
+    """ Return the configuration of the worker with the given index.
+
+        (int) -> (str, str, str, str)
+    """
+    search, var_heuristic, val_heuristic, schedule = \
+        CONFIGURATIONS[index % len(CONFIGURATIONS)]
+    if index >= len(CONFIGURATIONS) and schedule is None:
+        schedule = "luby"
+    return search, var_heuristic, val_heuristic, schedule
+
+
+def _run_worker(index, csp, initial_assignment, inference, seed, results):
+    """ Search the CSP with the configuration of the given worker and the
+        named inference (see get_inference_function), and put (index,
+        assignment, nodes expanded) on the results queue. The assignment is
+        UNKNOWN if the worker failed.
+    """
+    try:
+        search, var_heuristic, val_heuristic, schedule = worker_configuration(index)
+        select = get_variable_selection_function(var_heuristic)
+        order = get_value_ordering_function(val_heuristic)
+        infer = get_inference_function(inference)
+        cbj = search == "cbj"
+        nogoods = NogoodStore(NOGOOD_CAPACITY) if cbj else None
+        # Forward checking only prunes values which conflict with the
+        # variable just assigned, so its prunings have local explanations.
+        local_explanations = inference in (None, "forward")
+
+        if schedule is not None:
+            csp.rng = random.Random(seed)
+            assignment, explored, _ = backtracking_search.search_restarts(
+                csp, initial_assignment, select, order, infer, schedule=schedule,
+                cbj=cbj, local_explanations=local_explanations, nogoods=nogoods,
+                verbose=False)
+        elif cbj:
+            assignment, explored, _ = backtracking_search.search_cbj(
+                csp, initial_assignment, select, order, infer,
+                local_explanations=local_explanations, nogoods=nogoods,
+                verbose=False)
+        else:
+            assignment, explored, _ = backtracking_search.search(
+                csp, initial_assignment, select, order, infer, verbose=False)
+    except Exception as e:
+        print("Error: portfolio worker {} failed: {}".format(index, e))
+        assignment, explored = backtracking_search.UNKNOWN, 0
+    results.put((index, assignment, explored))
+
+
+def search(csp, initial_assignment, n_workers, seed, inference=None, deadline=None):
+    """ Search the CSP with a portfolio of n_workers worker processes, using
+        seed + i as the seed of worker i. Each worker does the named inference
+        (see get_inference_function) during search, or none if it is None.
+
+        Return the assignment found as a solution by the first worker to
+        finish, the number of nodes it expanded and the search time. If no
+        solution can be found, None will be returned in place of the solution.
+        If no worker has finished by the deadline (a time.time() value), the
+        workers are stopped and UNKNOWN is returned, with no nodes expanded.
+
+        (CSP, {str : str}, int, int, str) -> ({str : str}, int, float)
+    """
+    start_time = time.time()
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    workers = []
+    for index in range(n_workers):
+        worker = context.Process(target=_run_worker, daemon=True,
+                                 args=(index, csp, initial_assignment, inference, seed + index,
+                                       results))
+        worker.start()
+        workers.append(worker)
+
+    try:
+        n_failed = 0
+        while True:
+            if backtracking_search.interrupted(deadline, None):
+                index, assignment, explored = None, backtracking_search.UNKNOWN, 0
+                break
+            timeout = 1 if deadline is None else min(1, max(0, deadline - time.time()))
+            try:
+                index, assignment, explored = results.get(timeout=timeout)
+            except queue.Empty:
+                # A worker which died without reporting will never report
+                if any(worker.is_alive() for worker in workers):
+                    continue
+                raise SystemExit("[Fatal]: the portfolio workers stopped without an answer")
+            if assignment != backtracking_search.UNKNOWN:
+                break
+            n_failed += 1
+            if n_failed == n_workers:
+                raise SystemExit("[Fatal]: every portfolio worker failed")
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+    if index is not None:
+        print("Winning worker: {} {}".format(index, worker_configuration(index)))
+    if assignment is None:
+        print("No solution!")
+    elif assignment == backtracking_search.UNKNOWN:
+        print("Stopped without an answer!")
+    else:
+        print("Solved problem!")
+    print("Nodes expanded:", explored)
+    soln_time = time.time() - start_time
+    print("Time:", soln_time)
+    return assignment, explored, soln_time
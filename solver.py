@@ -25,9 +25,12 @@ import argparse
 import os
 import random
 import sys
+import time
 
-from csp import CSP
-from heuristics import (get_value_ordering_function,
+import tree_search
+from backtracking_search import UNKNOWN
+from csp import CSP, compiled_file_name
+from heuristics import (break_value_symmetry, get_value_ordering_function,
                         get_variable_selection_function)
 from inference import get_inference_function
 
@@ -67,21 +70,74 @@ def parse_cmd_line_args() -> argparse.Namespace:
                         help="The path to the input CSP file.")
     parser.add_argument("-o", "--output", dest="output_file_name", metavar="OUTPUT",
                         help="If given, write the grounded CSP to this file (and don't solve it).")
+    parser.add_argument("-c", "--compiled", dest="use_compiled",
+                        action="store_true", default=False,
+                        help="Load the CSP from its compiled .cspb sidecar if it is up to date, " +
+                        "otherwise parse the CSP file and write the sidecar for the next run.")
+    parser.add_argument("--lazy", dest="lazy_arcs",
+                        action="store_true", default=False,
+                        help="Only build the table of each binary constraint the first time " +
+                        "search needs it.")
     parser.add_argument("-s", "--solution", dest="solution_file_name", metavar="SOLUTION",
                         help="If given, write the satisfying assignment to this file.")
     parser.add_argument("-S", "--search", dest="search_algorithm", metavar="SEARCH",
-                        choices=["backtracking", "local"], default="backtracking",
-                        help="Choose a search algorithm from [%(choices)s] (default: %(default)s)")
+                        choices=["auto", "backtracking", "cbj", "local", "tree"], default="auto",
+                        help="Choose a search algorithm from [%(choices)s] (default: %(default)s). " +
+                        "auto solves problems whose constraint graph is a forest by tree search, " +
+                        "unless -v, -l, -i, -r, -g or --symmetry is given, which tree search " +
+                        "ignores, and everything else by backtracking.")
+    parser.add_argument("--max_cutset", dest="max_cutset", metavar="K", type=int, default=10,
+                        help="The largest cycle cutset the tree search conditions on. If the " +
+                        "cutset is larger, backtracking is used instead (default: %(default)s)")
+    parser.add_argument("--node_limit", dest="node_limit", metavar="NODES", type=int, default=None,
+                        help="Stop the search after expanding this many nodes (steps, for local " +
+                        "search), with the answer UNKNOWN. Not with --portfolio or --parallel.")
+    parser.add_argument("--time_limit", dest="time_limit", metavar="SECONDS", type=float, default=None,
+                        help="Stop the search after this many seconds, with the answer UNKNOWN.")
+    parser.add_argument("--components", dest="decompose",
+                        action="store_true", default=False,
+                        help="Search each connected component of the constraint graph on its own.")
+    parser.add_argument("--all", dest="all_solutions",
+                        action="store_true", default=False,
+                        help="Write every solution found by backtracking search, as it is found.")
+    parser.add_argument("--count", dest="count_solutions",
+                        action="store_true", default=False,
+                        help="Count the solutions with backtracking search, without writing them.")
+    parser.add_argument("--limit", dest="solution_limit", metavar="N", type=int, default=None,
+                        help="With --all or --count, stop after N solutions.")
+    parser.add_argument("--portfolio", dest="portfolio_size", metavar="N", type=int, default=0,
+                        help="Search with a portfolio of N worker processes, each using a different " +
+                        "search algorithm, heuristics and restarts (this overrides -S, -v, -l and -r), " +
+                        "and the inference given by -i. The first to finish wins.")
+    parser.add_argument("--parallel", dest="n_workers", metavar="N", type=int, default=0,
+                        help="Split the backtracking search between N worker processes, " +
+                        "which share out the work as they go.")
     parser.add_argument("-R", "--seed", dest="rng_seed", metavar="RNG", type=int, default=8193,
                         help="Select a seed for the random number generator (default: %(default)s)")
+    parser.add_argument("-g", "--nogoods", dest="nogood_capacity", metavar="N", type=int, default=0,
+                        help="With -S cbj, learn nogoods from the conflicts found during search, " +
+                        "keeping at most N of them. If 0, no nogoods are learned (default: %(default)s)")
+    parser.add_argument("-r", "--restarts", dest="restart_schedule", metavar="SCHEDULE",
+                        choices=["luby", "geometric"], default=None,
+                        help="Restart backtracking search with node limits following a schedule " +
+                        "from [%(choices)s], breaking ties in the heuristics randomly " +
+                        "(lex has no ties, so -v lex -l lex repeats the same search unless " +
+                        "-S cbj learns nogoods). If not given, the search is never restarted.")
+    parser.add_argument("--restart_cutoff", dest="restart_cutoff", metavar="NODES", type=int,
+                        default=100, help="The node limit of the first restart (default: %(default)s)")
     parser.add_argument("-v", "--var_heuristic", dest="variable_heuristic",
-                        choices=["lex", "md", "mrv", "md-mrv", "mrv-md"], default="lex",
+                        choices=["lex", "md", "mrv", "md-mrv", "mrv-md", "domwdeg"], default="lex",
                         metavar="VAR", help="Choose a variable selection heuristic from " +
                         "[%(choices)s] (default: %(default)s)")
     parser.add_argument("-l", "--val_heuristic", dest="value_heuristic",
                         choices=["lex", "lcvf"], default="lex",  metavar="VAL",
                         help="Choose a value selection heuristic from " +
                         "[%(choices)s] (default: %(default)s)")
+    parser.add_argument("--symmetry", dest="break_symmetry",
+                        action="store_true", default=False,
+                        help="If the values are interchangeable (as in graph colouring), only try " +
+                        "one of the values not used so far at each node. Not with --all, --count, " +
+                        "--portfolio or --parallel.")
     parser.add_argument("-p", "--preprocessing", dest="preprocessing",
                         choices=["arc"], default=None,  metavar="PRE",
                         help="Choose an inference function to use as a preprocessing step before search:" +
@@ -111,9 +167,257 @@ def parse_cmd_line_args() -> argparse.Namespace:
     print ("    Sudoku output:      ", args.sudoku_output)
     """
 
+    if args.node_limit is not None and (args.portfolio_size > 0 or args.n_workers > 0):
+        parser.error("--node_limit cannot be used with --portfolio or --parallel")
+
+    if args.n_workers > 0:
+        if args.portfolio_size > 0:
+            parser.error("--parallel cannot be used with --portfolio")
+        if args.search_algorithm not in ("auto", "backtracking"):
+            parser.error("--parallel only splits backtracking search, not -S " +
+                         args.search_algorithm)
+        if args.restart_schedule is not None:
+            parser.error("--parallel cannot be used with --restarts")
+
+    if args.break_symmetry:
+        if args.all_solutions or args.count_solutions:
+            parser.error("--symmetry cannot be used with --all or --count, " +
+                         "as it skips symmetric solutions")
+        if args.portfolio_size > 0 or args.n_workers > 0:
+            parser.error("--symmetry cannot be used with --portfolio or --parallel")
+
+    if args.all_solutions or args.count_solutions:
+        mode = "--all" if args.all_solutions else "--count"
+        if args.search_algorithm not in ("auto", "backtracking"):
+            parser.error(mode + " only enumerates with backtracking search, not -S " +
+                         args.search_algorithm)
+        for flag, given in (("--components", args.decompose),
+                            ("--portfolio", args.portfolio_size > 0),
+                            ("--parallel", args.n_workers > 0),
+                            ("--restarts", args.restart_schedule is not None)):
+            if given:
+                parser.error(mode + " cannot be used with " + flag)
+
     return args
 
 
+def enumerate_solutions(args, csp, initial_assignment, variable_selection_function,
+                        value_ordering_function, inference_search_function, deadline):
+    """ Write all the solutions of the CSP (--all), or just count them
+        (--count), up to the limit given by --limit. If the search stops at
+        the node limit or the deadline first, UNKNOWN is written before the
+        number of solutions found so far.
+    """
+    import backtracking_search
+    if args.solution_file_name is None:
+        solution_file = sys.stdout
+    else:
+        try:
+            solution_file = open(args.solution_file_name, "w")
+        except IOError as e:
+            print("Error: could not open output file:", args.solution_file_name)
+            return
+
+    if args.count_solutions:
+        print("Search algorithm: Backtracking (counting solutions)")
+        n_solutions, explored, search_time, stopped = backtracking_search.count_solutions(
+            csp, initial_assignment, variable_selection_function, value_ordering_function,
+            inference_search_function, args.solution_limit, node_limit=args.node_limit,
+            deadline=deadline)
+    else:
+        print("Search algorithm: Backtracking (all solutions)")
+        start_time = time.time()
+        stats = {}
+        n_solutions = 0
+        if args.solution_limit is None or args.solution_limit > 0:
+            for assignment in backtracking_search.solutions(
+                    csp, initial_assignment, variable_selection_function,
+                    value_ordering_function, inference_search_function, stats,
+                    node_limit=args.node_limit, deadline=deadline):
+                solution_file.write("Solution: " + " ".join([var+"="+val
+                                                             for var, val in assignment.items()]) + "\n")
+                n_solutions += 1
+                if n_solutions == args.solution_limit:
+                    break
+        explored = stats.get("nodes", 0)
+        search_time = time.time() - start_time
+        stopped = stats.get("stopped", False)
+
+    if stopped:
+        print("Stopped before finding every solution!")
+    print("Solutions:", n_solutions)
+    print("Nodes expanded:", explored)
+    print("Time:", search_time)
+
+    if stopped:
+        solution_file.write("UNKNOWN\n")
+    solution_file.write("Solutions: " + str(n_solutions) + "\n")
+    solution_file.write("Explored: " + str(explored) + "\n")
+    solution_file.write("Time: " + str(search_time) + "\n")
+
+
+def tree_search_ignores(args):
+    """ Return the options given on the command line which shape the
+        backtracking search, and which tree search therefore ignores.
+    """
+    given = [("-v", args.variable_heuristic != "lex"),
+             ("-l", args.value_heuristic != "lex"),
+             ("-i", args.search_inference is not None),
+             ("-r", args.restart_schedule is not None),
+             ("-g", args.nogood_capacity > 0),
+             ("--symmetry", args.break_symmetry)]
+    return [flag for flag, is_given in given if is_given]
+
+
+def run_search(args, csp, initial_assignment, variable_selection_function,
+               value_ordering_function, inference_search_function, node_limit, deadline):
+    """ Search the CSP with the search algorithm chosen by the command line
+        arguments, expanding at most node_limit nodes (if not None), and return
+        its (assignment, explored, search_time) result.
+    """
+    search = None
+    if args.portfolio_size > 0:
+        import portfolio
+        print("Search algorithm: Portfolio of", args.portfolio_size, "workers")
+        assignment, explored, search_time = portfolio.search(csp, initial_assignment,
+                                                             args.portfolio_size, args.rng_seed,
+                                                             inference=args.search_inference,
+                                                             deadline=deadline)
+
+    elif args.n_workers > 0:
+        import parallel_search
+        print("Search algorithm: Backtracking with", args.n_workers, "workers")
+        assignment, explored, search_time = parallel_search.search(
+            csp, initial_assignment, variable_selection_function, value_ordering_function,
+            args.search_inference, args.n_workers, deadline=deadline)
+
+    elif (args.search_algorithm == "auto" and not tree_search_ignores(args)
+          and tree_search.is_forest(csp)):
+        # A forest is solved without backtracking, in linear time
+        print("Search algorithm: Tree search (the constraint graph is a forest)")
+        assignment, explored, search_time = tree_search.search(csp, initial_assignment, [],
+                                                               node_limit=node_limit,
+                                                               deadline=deadline)
+
+    elif args.search_algorithm in ("auto", "backtracking", "cbj"):
+        import backtracking_search
+        cbj = args.search_algorithm == "cbj"
+        if cbj:
+            print("Search algorithm: Backtracking with conflict-directed backjumping")
+        else:
+            print("Search algorithm: Backtracking")
+        nogoods = None
+        if cbj and args.nogood_capacity > 0:
+            from nogoods import NogoodStore
+            nogoods = NogoodStore(args.nogood_capacity)
+        # Forward checking only prunes values which conflict with the
+        # variable just assigned, so its prunings have local explanations.
+        local_explanations = args.search_inference in (None, "forward")
+
+        if args.restart_schedule is not None:
+            print("Restart schedule:", args.restart_schedule)
+            # Lexicographic order has no ties to break randomly, so only
+            # learned nogoods can make one run differ from the last
+            if (args.variable_heuristic == "lex" and args.value_heuristic == "lex"
+                    and nogoods is None):
+                print("Warning: every restart searches the same tree with -v lex -l lex; " +
+                      "use a randomised heuristic, or -S cbj with nogoods")
+            csp.rng = random.Random(args.rng_seed)
+            assignment, explored, search_time = backtracking_search.search_restarts(
+                csp, initial_assignment, variable_selection_function, value_ordering_function,
+                inference_search_function, schedule=args.restart_schedule,
+                cutoff=args.restart_cutoff, cbj=cbj, local_explanations=local_explanations,
+                nogoods=nogoods, node_limit=node_limit, deadline=deadline)
+        elif cbj:
+            assignment, explored, search_time = backtracking_search.search_cbj(
+                csp, initial_assignment, variable_selection_function, value_ordering_function,
+                inference_search_function, local_explanations=local_explanations,
+                nogoods=nogoods, node_limit=node_limit, deadline=deadline)
+        else:
+            assignment, explored, search_time = backtracking_search.search(csp, initial_assignment,
+                                                                           variable_selection_function, value_ordering_function, inference_search_function,
+                                                                           node_limit=node_limit, deadline=deadline)
+        if nogoods is not None:
+            print("Nogoods learned:", nogoods.n_learned, "evicted:", nogoods.n_evicted)
+
+    elif args.search_algorithm == "local":
+        import local_search
+        print("Search algorithm: Local Search")
+        # Each step of local search counts as a node
+        max_steps = args.max_steps
+        if node_limit is not None:
+            max_steps = min(max_steps, node_limit)
+        assignment, explored, search_time = local_search.search(csp, initial_assignment,
+                                                                variable_selection_function, value_ordering_function, max_steps,
+                                                                deadline=deadline)
+    elif args.search_algorithm == "tree":
+        import backtracking_search
+        cutset = tree_search.cycle_cutset(csp)
+        print("Cycle cutset:", len(cutset), "variables")
+        if len(cutset) <= args.max_cutset:
+            print("Search algorithm: Tree search with cutset conditioning")
+            ignored = tree_search_ignores(args)
+            if ignored:
+                print("Warning: tree search ignores " + ", ".join(ignored))
+            assignment, explored, search_time = tree_search.search(csp, initial_assignment, cutset,
+                                                                   node_limit=node_limit,
+                                                                   deadline=deadline)
+        else:
+            print("Search algorithm: Backtracking (the cycle cutset is too large)")
+            assignment, explored, search_time = backtracking_search.search(csp, initial_assignment,
+                                                                           variable_selection_function, value_ordering_function, inference_search_function,
+                                                                           node_limit=node_limit, deadline=deadline)
+    else:
+        raise SystemExit(
+            "[Fatal]: Search algorithm {} is not supported!".format(args.search_algorithm))
+
+    return assignment, explored, search_time
+
+
+def solve_components(args, csp, initial_assignment, variable_selection_function,
+                     value_ordering_function, inference_search_function, deadline):
+    """ Search each connected component of the constraint graph of the CSP on
+        its own (see run_search), smallest first, and merge their solutions.
+        A failure in one component then never makes the search undo the
+        assignments of another. The variables without constraints are
+        searched together. We stop as soon as a component has no solution,
+        or the search of one stops without an answer. The node limit and the
+        deadline apply to the searches of all the components together.
+    """
+    components = csp.components()
+    print("Connected components:", len(components))
+    if len(components) == 1:
+        return run_search(args, csp, initial_assignment, variable_selection_function,
+                          value_ordering_function, inference_search_function, args.node_limit,
+                          deadline)
+
+    groups = [component for component in components if len(component) > 1]
+    unconstrained = [component[0] for component in components if len(component) == 1]
+    if unconstrained:
+        groups.append(unconstrained)
+    groups.sort(key=len)
+
+    start_time = time.time()
+    assignment = {}
+    explored = 0
+    for index, group in enumerate(groups):
+        print("Component {} of {}: {} variables".format(index + 1, len(groups), len(group)))
+        group_assignment = dict((var, initial_assignment[var])
+                                for var in group if var in initial_assignment)
+        # The components share the node limit, as they share the deadline
+        node_limit = None
+        if args.node_limit is not None:
+            node_limit = args.node_limit - explored
+        result, group_explored, _ = run_search(
+            args, csp.fork(group), group_assignment, variable_selection_function,
+            value_ordering_function, inference_search_function, node_limit, deadline)
+        explored += group_explored
+        if result is None or result == UNKNOWN:
+            return result, explored, time.time() - start_time
+        assignment.update(result)
+    return assignment, explored, time.time() - start_time
+
+
 def main():
     """ Parse the command line arguments. Make the CSP object. Do preprocessing
         if requested. Then call the search object.
@@ -128,14 +432,41 @@ def main():
     variable_selection_function = get_variable_selection_function(
         args.variable_heuristic)
     value_ordering_function = get_value_ordering_function(args.value_heuristic)
+    if args.break_symmetry:
+        value_ordering_function = break_value_symmetry(value_ordering_function)
     inference_pre_function = get_inference_function(args.preprocessing)
     inference_search_function = get_inference_function(args.search_inference)
 
-    print("Parsing CSP file:", args.input_file_name)
-    csp = CSP()
-    if not csp.parse_csp_file(args.input_file_name):
-        return
-    print("Success.")
+    # The allowed pairs of the constraints are only needed as given if we
+    # write the grounded CSP out
+    keep_ground_conflicts = args.output_file_name is not None
+    csp = None
+    if args.use_compiled:
+        # A sidecar written in another mode is parsed again and replaced
+        csp = CSP.load_compiled(args.input_file_name, lazy=args.lazy_arcs,
+                                keep_ground_conflicts=keep_ground_conflicts)
+        if csp is not None:
+            print("Loaded compiled CSP:", compiled_file_name(args.input_file_name))
+    if csp is None:
+        print("Parsing CSP file:", args.input_file_name)
+        csp = CSP(lazy=args.lazy_arcs, keep_ground_conflicts=keep_ground_conflicts)
+        if not csp.parse_csp_file(args.input_file_name):
+            return
+        print("Success.")
+        if args.use_compiled:
+            try:
+                csp.save_compiled(args.input_file_name)
+                print("Wrote compiled CSP:", compiled_file_name(args.input_file_name))
+            except IOError as e:
+                print("Warning: could not write compiled CSP:",
+                      compiled_file_name(args.input_file_name))
+
+    # The dom/wdeg heuristic needs the search to weigh the constraints
+    csp.learn_weights = args.variable_heuristic == "domwdeg"
+
+    if args.break_symmetry:
+        csp.interchangeable_values = csp.find_interchangeable_values()
+        print("Interchangeable values:", "yes" if csp.interchangeable_values else "no")
 
     # We can't make any initial assignment. Suppose we have:
     #   var a : 1
@@ -173,21 +504,23 @@ def main():
             print("Error: cannot open output file:", args.output_file_name)
         return
 
-    search = None
-    if args.search_algorithm == "backtracking":
-        import backtracking_search
-        print("Search algorithm: Backtracking")
-        assignment, explored, search_time = backtracking_search.search(csp, initial_assignment,
-                                                                       variable_selection_function, value_ordering_function, inference_search_function)
+    deadline = None
+    if args.time_limit is not None:
+        deadline = time.time() + args.time_limit
 
-    elif args.search_algorithm == "local":
-        import local_search
-        print("Search algorithm: Local Search")
-        assignment, explored, search_time = local_search.search(csp, initial_assignment,
-                                                                variable_selection_function, value_ordering_function, args.max_steps)
+    if args.all_solutions or args.count_solutions:
+        enumerate_solutions(args, csp, initial_assignment, variable_selection_function,
+                            value_ordering_function, inference_search_function, deadline)
+        return
+
+    if args.decompose:
+        assignment, explored, search_time = solve_components(
+            args, csp, initial_assignment, variable_selection_function,
+            value_ordering_function, inference_search_function, deadline)
     else:
-        raise SystemExit(
-            "[Fatal]: Search algorithm {} is not supported!".format(args.search_algorithm))
+        assignment, explored, search_time = run_search(
+            args, csp, initial_assignment, variable_selection_function,
+            value_ordering_function, inference_search_function, args.node_limit, deadline)
 
     if args.solution_file_name is None:
         solution_file = sys.stdout
@@ -204,6 +537,11 @@ def main():
         solution_file.write("UNSAT\n")
         solution_file.write("Explored: " + str(explored) + "\n")
         solution_file.write("Time: " + str(search_time) + "\n")
+    elif assignment == UNKNOWN:
+        print("The search stopped without an answer.")
+        solution_file.write("UNKNOWN\n")
+        solution_file.write("Explored: " + str(explored) + "\n")
+        solution_file.write("Time: " + str(search_time) + "\n")
     else:
         print("Solution found.")
         if args.sudoku_output:
@@ -0,0 +1,236 @@
+# COMP3620/6320 Artificial Intelligence
+# The Australian National University
+# Authors: COMP-3620 team
+# Date:    2021
+
+""" This file implements search for CSPs whose constraint graph is a tree,
+    or close to one.
+
+    A CSP whose constraint graph is a forest is solved without backtracking:
+    we order each tree from a root, make every variable arc consistent with
+    its children, from the leaves up (directional arc consistency), and then
+    give each variable, from the root down, a value which agrees with its
+    parent. This takes O(n d^2) time for n variables with d values.
+
+    Otherwise, we pick a cycle cutset: a set of variables whose removal leaves
+    a forest. For each consistent assignment of the cutset variables, the
+    domains of the rest are restricted to the values which agree with it, and
+    the forest is solved as above (cutset conditioning). This takes
+    O(d^c n d^2) time for a cutset of c variables, so it only pays off when
+    the cutset is small.
+"""
+
+import time
+
+from backtracking_search import INTERRUPT_INTERVAL, UNKNOWN, interrupted
+from csp import iter_bits
+
+
+def cycle_cutset(csp):
+    """ Return a cycle cutset of the constraint graph of the CSP: a list of
+        variables, without which the graph has no cycles. It is empty if the
+        graph is a forest.
+
+        The cutset is found greedily, so it is small but not always the
+        smallest: we repeatedly remove the variables with at most one
+        neighbour left, which cannot be on a cycle, and when there are none,
+        move a variable with the most neighbours left into the cutset.
+
+        (CSP) -> [str]
+    """
+    neighbours = csp.neighbours
+    degree = {var: len(neighbours[var]) for var in csp.variables}
+    removed = set()
+    cutset = []
+
+    def remove(var, frontier):
+        removed.add(var)
+        for ovar in neighbours[var]:
+            if ovar not in removed:
+                degree[ovar] -= 1
+                frontier.append(ovar)
+
+    frontier = list(csp.variables)
+    while True:
+        while frontier:
+            var = frontier.pop()
+            if var not in removed and degree[var] <= 1:
+                remove(var, frontier)
+        remaining = [var for var in csp.variables if var not in removed]
+        if not remaining:
+            return cutset
+        var = max(remaining, key=degree.__getitem__)
+        cutset.append(var)
+        remove(var, frontier)
+
+
+def is_forest(csp):
+    """ Return True if the constraint graph of the CSP has no cycles, so that
+        its cycle cutset is empty. A graph is a forest iff it has one edge
+        fewer than it has variables in each connected component, so this takes
+        time linear in the size of the graph.
+
+        (CSP) -> bool
+    """
+    n_edges = sum(len(csp.neighbours[var]) for var in csp.variables) // 2
+    return n_edges == len(csp.variables) - len(csp.components())
+
+
+def _forest_order(csp, forest):
+    """ Return the variables (ids) of the forest, tree by tree, in an order
+        where each variable comes after its parent, as (id, parent id) pairs.
+        The parent of the root of a tree is None.
+
+        (CSP, set([str])) -> [(int, int)]
+    """
+    var_ids = csp.var_ids
+    order = []
+    seen = set()
+    for root in csp.variables:
+        if root not in forest or root in seen:
+            continue
+        seen.add(root)
+        order.append((var_ids[root], None))
+        frontier = [root]
+        while frontier:
+            parent = frontier.pop()
+            for child in csp.neighbours[parent]:
+                if child in forest and child not in seen:
+                    seen.add(child)
+                    order.append((var_ids[child], var_ids[parent]))
+                    frontier.append(child)
+    return order
+
+
+def _solve_forest(masks, order, down_supports):
+    """ Solve the forest given by order (see _forest_order), where masks maps
+        each variable id to its domain mask (which is modified), and
+        down_supports[id] are the supports of the arc from the parent of id to
+        id. Return the bit of the value of each variable, or None if there is
+        no solution.
+
+        ({int : int}, [(int, int)], {int : [int]}) -> {int : int}
+    """
+    # Directional arc consistency, from the leaves up
+    for var_id, parent_id in reversed(order):
+        child_mask = masks[var_id]
+        if not child_mask:
+            return None
+        if parent_id is None:
+            continue
+        supports = down_supports[var_id]
+        parent_mask = 0
+        for bit in iter_bits(masks[parent_id]):
+            if supports[bit] & child_mask:
+                parent_mask |= 1 << bit
+        masks[parent_id] = parent_mask
+
+    # Every value left has a support in each child, so this never fails
+    bits = {}
+    for var_id, parent_id in order:
+        mask = masks[var_id]
+        if parent_id is not None:
+            mask &= down_supports[var_id][bits[parent_id]]
+        bits[var_id] = (mask & -mask).bit_length() - 1
+    return bits
+
+
+def search(csp, initial_assignment, cutset, node_limit=None, deadline=None, cancel=None):
+    """ Solve the CSP by cutset conditioning on the given cycle cutset (see
+        cycle_cutset), solving the forest left for each assignment of the
+        cutset. The variables of the initial assignment are conditioned on
+        too, with just their assigned value.
+
+        Return the assignment found as a solution, the number of nodes expanded
+        (values tried for the cutset variables, and forests solved) and the
+        search time. If no solution can be found, None will be returned in
+        place of the solution. If the search stops after node_limit nodes, at
+        the deadline or when the cancel token is set (see
+        backtracking_search.interrupted), UNKNOWN is returned instead.
+
+        (CSP, {str : str}, [str], int, float, object) -> ({str : str}, int, float)
+    """
+    start_time = time.time()
+    var_ids = csp.var_ids
+    masks = csp.domain_masks
+
+    conditioned = list(cutset) + [var for var in initial_assignment if var not in cutset]
+    forest = set(csp.variables).difference(conditioned)
+    order = _forest_order(csp, forest)
+    down_supports = {var_id: csp.arc_supports(parent_id, var_id)
+                     for var_id, parent_id in order if parent_id is not None}
+
+    # The values each conditioned variable may take, and the arcs to the
+    # earlier conditioned variables and to the forest
+    candidates = []
+    earlier_arcs = []
+    forest_arcs = []
+    for index, var in enumerate(conditioned):
+        var_id = var_ids[var]
+        mask = masks[var_id]
+        if var in initial_assignment:
+            mask &= 1 << csp.value_ids[var_id][initial_assignment[var]]
+        candidates.append(list(iter_bits(mask)))
+        earlier = set(conditioned[:index])
+        earlier_arcs.append([(var_ids[ovar], csp.arc_supports(var_id, var_ids[ovar]))
+                             for ovar in csp.neighbours[var] if ovar in earlier])
+        forest_arcs.append([(var_ids[ovar], csp.arc_supports(var_id, var_ids[ovar]))
+                            for ovar in csp.neighbours[var] if ovar in forest])
+
+    n_expanded_nodes = 0
+    bits = {}
+    solution = None
+    stopped = False
+
+    # Depth-first search over the assignments of the conditioned variables.
+    # positions[i] is the position in candidates[i] of the value being tried.
+    positions = [-1] * len(conditioned)
+    depth = 0
+    while depth >= 0:
+        if (n_expanded_nodes == node_limit or
+                n_expanded_nodes % INTERRUPT_INTERVAL == 0 and interrupted(deadline, cancel)):
+            stopped = True
+            break
+
+        if depth == len(conditioned):
+            # Solve the forest left with the domains which agree with the
+            # conditioned variables
+            n_expanded_nodes += 1
+            forest_masks = {var_id: masks[var_id] for var_id, _ in order}
+            for index in range(len(conditioned)):
+                bit = bits[var_ids[conditioned[index]]]
+                for ovar_id, supports in forest_arcs[index]:
+                    forest_masks[ovar_id] &= supports[bit]
+            forest_bits = _solve_forest(forest_masks, order, down_supports)
+            if forest_bits is not None:
+                bits.update(forest_bits)
+                solution = bits
+                break
+            depth -= 1
+            continue
+
+        positions[depth] += 1
+        if positions[depth] >= len(candidates[depth]):
+            positions[depth] = -1
+            depth -= 1
+            continue
+        n_expanded_nodes += 1
+        bit = candidates[depth][positions[depth]]
+        if all((supports[bit] >> bits[ovar_id]) & 1 for ovar_id, supports in earlier_arcs[depth]):
+            bits[var_ids[conditioned[depth]]] = bit
+            depth += 1
+
+    if stopped:
+        print("Stopped without an answer!")
+        assignment = UNKNOWN
+    elif solution is None:
+        print("No solution!")
+        assignment = None
+    else:
+        print("Solved problem!")
+        assignment = {var: csp.value_lists[var_ids[var]][bits[var_ids[var]]]
+                      for var in csp.variables}
+    print("Nodes expanded:", n_expanded_nodes)
+    soln_time = time.time() - start_time
+    print("Time:", soln_time)
+    return assignment, n_expanded_nodes, soln_time